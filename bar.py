@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
-import subprocess
-import re
+import sys
 from datetime import datetime
 import random
 
@@ -11,8 +10,21 @@ from gi.repository import Gtk, Gdk, GtkLayerShell, GLib, Gio
 
 import hyprland
 import pulseaudio
+import mpv
+import battery
+import scheduler
+import store
 from bar_menu import PopupMenu
 
+# socket2 events that can change the workspace buttons
+WORKSPACE_EVENTS = {
+    'createworkspace', 'createworkspacev2',
+    'destroyworkspace', 'destroyworkspacev2',
+    'workspace', 'workspacev2',
+    'focusedmon', 'focusedmonv2',
+    'moveworkspace', 'moveworkspacev2',
+}
+
 class VolumeSlider(Gtk.Box):
     def __init__(self):
         super(VolumeSlider, self).__init__(orientation=Gtk.Orientation.HORIZONTAL, spacing=0)
@@ -23,9 +35,9 @@ class VolumeSlider(Gtk.Box):
         self.scale.set_draw_value(True)
         self.scale.set_value_pos(Gtk.PositionType.LEFT)
         self.scale.set_size_request(200, -1)
-        self.scale.connect(
+        self.changed_handler = self.scale.connect(
             "value-changed",
-            lambda x: pulseaudio.set_default_sink_volume(int(self.scale.get_value()))
+            lambda x: pulseaudio.volume_writer().set(self.scale.get_value())
         )
         self.pack_start(self.icon, False, False, 0)
         self.pack_start(self.scale, False, False, 0)
@@ -48,6 +60,9 @@ class SystemBar(Gtk.Window):
         # self.set_hexpand(False)
         self.set_title("bar")
 
+        # sources publish into the store, widgets are bound to the keys they show
+        self.store = store.Store(self)
+
         # initialize gtk layer shell
         GtkLayerShell.init_for_window(self)
         GtkLayerShell.auto_exclusive_zone_enable(self)
@@ -69,8 +84,12 @@ class SystemBar(Gtk.Window):
         self.box.pack_start(self.main_label, True, True, 0)
 
         # initialize workspace buttons
-        self.workspace_buttons = []
-        self.update_workspace_buttons()
+        self.workspaces = hyprland.WorkspaceModel()
+        self.workspace_buttons = {} # workspace id -> button
+        self.button_pool = [] # detached buttons kept around for reuse
+        self.highlighted_button = None
+        self.store.bind(('workspaces', 'active_workspace'), self.update_workspace_buttons)
+        self.resync_workspaces()
 
         menu_button = Gtk.Button()
         icon = Gtk.Image.new_from_icon_name("open-menu", Gtk.IconSize.BUTTON)
@@ -97,101 +116,157 @@ class SystemBar(Gtk.Window):
         # self.brightness_slider = BrightnessSlider()
         # self.box.pack_end(self.brightness_slider, False, False, 0)
 
-        # periodic updates
-        GLib.timeout_add_seconds(1, self.update_date)
-        GLib.timeout_add_seconds(1, self.update_battery)
-        GLib.timeout_add_seconds(0.3, self.update_track_text)
+        self.store.bind('date', self.date_label.set_text)
+        self.store.bind('battery', self.bat_label.set_text)
+        self.store.bind('track', self.main_label.set_text)
+        self.store.bind('volume', self.set_volume_slider)
+        # the slider shows what the user picked too, so later changes compare against that
+        self.volume_slider.scale.connect(
+            "value-changed", lambda scale: self.store.publish('volume', int(scale.get_value())))
+
+        # periodic updates share aligned wakeups, and slow down while the bar is hidden or the session idle
+        self.scheduler = scheduler.default()
+        self.scheduler.add(self.update_date, 1)
+        self.connect("map-event", lambda *_: self.scheduler.set_throttled('unmapped', False))
+        self.connect("unmap-event", lambda *_: self.scheduler.set_throttled('unmapped', True))
+        self.idle_watch = scheduler.watch_session_idle(
+            lambda idle: self.scheduler.set_throttled('idle', idle))
+
+        # battery label, updated only when a battery changes
+        self.battery_provider = battery.BatteryProvider(self.update_battery)
+        self.battery_provider.start()
+
+        # track label, pushed by mpv whenever the track changes
+        self.track_source = mpv.MpvSource(self.set_track_text)
+        self.track_source.start()
 
         # hyprland listener for workspace changes
-        def hyprland_handler(event_line):
-            if event_line.startswith('workspace>>'):
-                GLib.idle_add(lambda: (self.update_workspace_buttons(), self.show_all()))
-        hyprland.add_listener(hyprland_handler)
-
+        # bursts of events are coalesced into one update per frame
+        self.workspace_events = hyprland.EventCoalescer(self.on_workspace_events,
+                                                        events=WORKSPACE_EVENTS)
+        for event in WORKSPACE_EVENTS:
+            hyprland.on(event, self.workspace_events.push_event)
+        # a full re-sync is only needed when the event socket (re)connects
+        hyprland.on_connect(lambda: GLib.idle_add(self.resync_workspaces))
+
+        self.volume_update_queued = False
         self.update_volume()
-        # pulseaudio listen for volume changes
-        def pulseaudio_handler(event_line):
-            GLib.idle_add(lambda: self.update_volume())
-        pulseaudio.add_listener(pulseaudio_handler)
-
-    def toggle_popup(self, button):
-        print('test')
-        if self.popup and self.popup.is_visible():
-            self.popup.destroy()
-            self.popup = None
+        # pulseaudio listen for volume changes of the default sink (or a different default sink)
+        pulseaudio.subscribe(self.on_volume_event, 'sink', pulseaudio.DEFAULT_SINK)
+        pulseaudio.subscribe(self.on_volume_event, 'server')
+
+    def toggle_popup(self, button=None):
+        # the popup is built on first use and then only hidden and shown
+        if self.popup is None:
+            self.popup = PopupMenu(persistent=True)
+        if self.popup.is_visible():
+            self.popup.dismiss()
         else:
-            self.popup = PopupMenu()
-            self.popup.show_all()
-
-    def update_volume(self):
-        self.volume_slider.scale.set_value(int(pulseaudio.get_default_sink_volume()))
+            self.popup.popup()
 
-    def update_workspace_buttons(self):
-        """fetch the current workspace information and create buttons for each workspace."""
-        result = subprocess.run(["hyprctl", "workspaces"], capture_output=True, text=True)
-        workspaces = self.parse_workspaces(result.stdout)
+    def on_volume_event(self, event):
+        # several events may arrive before the main loop gets to them, refresh only once
+        if not self.volume_update_queued:
+            self.volume_update_queued = True
+            GLib.idle_add(self.update_volume)
 
-        # remove old buttons
-        for button in self.workspace_buttons:
+    def update_volume(self):
+        self.volume_update_queued = False
+        # ignore the events our own writes cause, they would move the slider back while
+        # dragging. the volume is read once more when they're over, so neither our last
+        # write nor a change someone else made meanwhile is missed
+        remaining = pulseaudio.volume_writer().echo_remaining()
+        if remaining > 0:
+            self.volume_update_queued = True
+            GLib.timeout_add(int(remaining * 1000) + 1, self.update_volume)
+            return
+        self.store.publish('volume', int(pulseaudio.get_default_sink_volume()))
+
+    def set_volume_slider(self, volume):
+        scale = self.volume_slider.scale
+        with scale.handler_block(self.volume_slider.changed_handler):
+            scale.set_value(volume)
+
+    def resync_workspaces(self):
+        """rebuild the workspace model from hyprland and update the buttons to match."""
+        try:
+            self.workspaces.sync(hyprland.client())
+        except (OSError, ValueError) as e:
+            # e.g. started before hyprland, the model stays as it is until the event socket connects
+            print(f"hyprland: cannot read workspaces: {e}", file=sys.stderr)
+            return
+        self.publish_workspaces()
+
+    def on_workspace_events(self, events):
+        for event, data in events:
+            self.workspaces.apply(event, data)
+        self.publish_workspaces()
+
+    def publish_workspaces(self):
+        self.store.publish('workspaces', tuple(self.workspaces.ids()))
+        self.store.publish('active_workspace', self.workspaces.active)
+
+    def update_workspace_buttons(self, ids, active):
+        """bring the workspace buttons in line with the model, touching only the ones that changed."""
+
+        # detach buttons of destroyed workspaces and keep them for reuse
+        for workspace_id in set(self.workspace_buttons) - set(ids):
+            button = self.workspace_buttons.pop(workspace_id)
+            if button is self.highlighted_button:
+                button.get_style_context().remove_class("highlighted")
+                self.highlighted_button = None
             self.workspace_box.remove(button)
-
-        self.workspace_buttons.clear()
-
-        # fetch the current active workspace
-        current_workspace = self.get_current_workspace_from_hyprland()
-
-        # add new buttons for each workspace
-        for i, workspace in enumerate(workspaces):
-            button = Gtk.Button(label=str(workspace['id']))
-            button.connect("clicked", self.on_workspace_button_clicked, workspace['id'])
-            button.get_style_context().add_class("bar_button")
-            self.workspace_buttons.append(button)
-            self.workspace_box.pack_start(button, False, False, 0)
-            if current_workspace == workspace['id']:
-                button_context = button.get_style_context()
-                button_context.add_class("highlighted")
-
-        self.workspace_box.show_all()
-
-    def parse_workspaces(self, output):
-        """parse workspace information from the hyprctl output."""
-        workspaces = []
-        for line in output.splitlines():
-            match = re.match(r'workspace ID (\d+)', line)
-            if match:
-                workspaces.append({'id': int(match.group(1))})
-        workspaces.sort(key=lambda x: x['id'])
-        return workspaces
+            self.button_pool.append(button)
+
+        # add buttons for new workspaces and keep them sorted by id
+        for position, workspace_id in enumerate(ids):
+            button = self.workspace_buttons.get(workspace_id)
+            if button is None:
+                button = self.get_workspace_button()
+                button.workspace_id = workspace_id
+                button.set_label(str(workspace_id))
+                self.workspace_buttons[workspace_id] = button
+                self.workspace_box.pack_start(button, False, False, 0)
+                button.show()
+            self.workspace_box.reorder_child(button, position)
+
+        # move the highlight to the active workspace
+        active_button = self.workspace_buttons.get(active)
+        if active_button is not self.highlighted_button:
+            if self.highlighted_button:
+                self.highlighted_button.get_style_context().remove_class("highlighted")
+            if active_button:
+                active_button.get_style_context().add_class("highlighted")
+            self.highlighted_button = active_button
+
+    def get_workspace_button(self):
+        """take a button from the pool, or create one if the pool is empty."""
+        if self.button_pool:
+            return self.button_pool.pop()
+        button = Gtk.Button()
+        button.connect("clicked", lambda button: self.on_workspace_button_clicked(button, button.workspace_id))
+        button.get_style_context().add_class("bar_button")
+        return button
 
     def on_workspace_button_clicked(self, button, workspace_id):
         """handle workspace button clicks and switch workspace."""
-        subprocess.run(["hyprctl", "dispatch", "workspace", str(workspace_id)])
-
-    def update_track_text(self):
-        """update the current workspace label and button state."""
-        result = subprocess.run(["current_mpv_track_more.sh"],
-                                capture_output=True, text=True, shell=True)
-        if result:
-            self.main_label.set_text(result.stdout[:80])
-        return True # keep the timeout running
-
-    def get_current_workspace_from_hyprland(self):
-        """get the current workspace using hyprland IPC."""
-        result = subprocess.run(["hyprctl", "activeworkspace"], capture_output=True, text=True)
-        match = re.search(r'workspace ID (\d+)', result.stdout)
-        return int(match.group(1)) if match else None
+        try:
+            hyprland.client().dispatch("workspace", workspace_id)
+        except (OSError, hyprland.HyprlandError) as e:
+            print(f"hyprland: cannot switch to workspace {workspace_id}: {e}", file=sys.stderr)
+
+    def set_track_text(self, text):
+        """update the track label."""
+        self.store.publish('track', text[:80])
 
     def update_date(self):
         """update the date label."""
         now = datetime.now()
-        self.date_label.set_text(now.strftime("%a %H:%M:%S %Y-%m-%d"))
-        return True # keep updating every second
+        self.store.publish('date', now.strftime("%a %H:%M:%S %Y-%m-%d"))
 
-    def update_battery(self):
+    def update_battery(self, readings):
         """update the battery label."""
-        out = subprocess.check_output("acpi | grep -v ' 0%'", shell=True).decode()[:-1].split(', ')[1]
-        self.bat_label.set_text('BAT ' + out)
-        return True # keep updating every second
+        self.store.publish('battery', battery.format_readings(readings))
 
 if __name__ == "__main__":
     window = SystemBar()
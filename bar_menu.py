@@ -5,9 +5,13 @@ gi.require_version("Gtk", "3.0")
 gi.require_version("GtkLayerShell", "0.1")
 from gi.repository import Gtk, GtkLayerShell, Gdk, Gio
 
+import pulseaudio
+
 class PopupMenu(Gtk.Window):
-    def __init__(self):
+    def __init__(self, persistent=False):
         super().__init__(title="System Menu")
+        # a persistent popup is built once and only hidden when closed, so it can be shown again instantly
+        self.persistent = persistent
         # self.set_default_size(300, 400)
         self.set_size_request(300, 400)
         self.set_border_width(10)
@@ -102,7 +106,7 @@ class PopupMenu(Gtk.Window):
         self.volume_slider = Gtk.Scale(orientation=Gtk.Orientation.HORIZONTAL)
         self.volume_slider.set_range(0, 100)
         self.volume_slider.set_value(self.get_volume())
-        self.volume_slider.connect("value-changed", self.set_volume)
+        self.volume_changed_handler = self.volume_slider.connect("value-changed", self.set_volume)
 
         vbox.pack_start(Gtk.Label(label="Brightness"), False, False, 0)
         vbox.pack_start(self.brightness_slider, False, False, 0)
@@ -110,20 +114,33 @@ class PopupMenu(Gtk.Window):
         vbox.pack_start(Gtk.Label(label="Volume"), False, False, 0)
         vbox.pack_start(self.volume_slider, False, False, 0)
 
-        self.show_all()
+        if not persistent:
+            self.show_all()
 
         # grab focus when created
         # self.grab_focus()
 
+    def popup(self):
+        """show the (persistent) popup, refreshing what may have changed while hidden."""
+        with self.volume_slider.handler_block(self.volume_changed_handler):
+            self.volume_slider.set_value(self.get_volume())
+        self.show_all()
+
+    def dismiss(self):
+        if self.persistent:
+            self.hide()
+        else:
+            self.destroy()
+
     def on_focus_lost(self, widget, event=None):
-        self.destroy()
+        self.dismiss()
 
     def on_key_press(self, widget, event):
         if event.keyval == Gdk.KEY_Escape:
-            self.destroy()
+            self.dismiss()
 
     def on_close_clicked(self, button):
-        self.destroy()
+        self.dismiss()
 
     def load_wifi_networks(self, button):
         for child in self.wifi_list.get_children():
@@ -181,15 +198,10 @@ class PopupMenu(Gtk.Window):
         pass
 
     def get_volume(self):
-        return int(subprocess.check_output(
-            r"pactl get-sink-volume @DEFAULT_SINK@ | grep -Po '\d+(?=%)' | head -n 1",
-            shell=True).strip())
+        return int(pulseaudio.get_default_sink_volume())
 
     def set_volume(self, slider):
-        perc = slider.get_value()
-        subprocess.run(
-            f"pactl set-sink-volume @DEFAULT_SINK@ {perc}%",
-            shell=True)
+        pulseaudio.volume_writer().set(slider.get_value())
 
 if __name__ == '__main__':
     win = PopupMenu()
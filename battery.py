@@ -0,0 +1,137 @@
+import os
+import socket
+
+from gi.repository import GLib
+
+import scheduler
+
+POWER_SUPPLY = '/sys/class/power_supply'
+NETLINK_KOBJECT_UEVENT = 15
+
+class Battery:
+    """one battery in sysfs, with its capacity and status files kept open."""
+
+    def __init__(self, path):
+        self.name = os.path.basename(path)
+        self.capacity_fd = os.open(os.path.join(path, 'capacity'), os.O_RDONLY)
+        self.status_fd = os.open(os.path.join(path, 'status'), os.O_RDONLY)
+
+    def read(self):
+        """return (capacity, status), e.g. (85, 'Discharging')."""
+        capacity = int(os.pread(self.capacity_fd, 16, 0))
+        status = os.pread(self.status_fd, 32, 0).decode().strip()
+        return capacity, status
+
+    def close(self):
+        os.close(self.capacity_fd)
+        os.close(self.status_fd)
+
+def find_batteries():
+    batteries = []
+    try:
+        names = sorted(os.listdir(POWER_SUPPLY))
+    except FileNotFoundError:
+        return batteries
+    for name in names:
+        path = os.path.join(POWER_SUPPLY, name)
+        try:
+            with open(os.path.join(path, 'type')) as f:
+                if f.read().strip() != 'Battery':
+                    continue
+            batteries.append(Battery(path))
+        except OSError: # e.g. a peripheral's battery without a capacity file
+            continue
+    return batteries
+
+class BatteryProvider:
+    """calls `callback(readings)` with [(name, capacity, status), ...] whenever one changes.
+
+    reads sysfs directly, wakes up on kernel power_supply uevents (e.g. the
+    charger being plugged in) and otherwise re-reads on an adaptive interval
+    between `min_interval` and `max_interval` seconds, since most batteries
+    don't send an event for every percent."""
+
+    def __init__(self, callback, min_interval=30, max_interval=120):
+        self.callback = callback
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.batteries = []
+        self.readings = None
+        self.timeout_source = None
+        self.uevent_sock = None
+
+    def start(self):
+        self.batteries = find_batteries()
+        self.listen_uevents()
+        self.update()
+        self.schedule()
+
+    def listen_uevents(self):
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, 1)) # multicast group 1: kernel events
+        except (OSError, AttributeError): # no netlink, the poll alone will do
+            return
+        sock.setblocking(False)
+        self.uevent_sock = sock
+        GLib.io_add_watch(sock.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self.on_uevent)
+
+    def on_uevent(self, fd, condition):
+        relevant = False
+        while True:
+            try:
+                message = self.uevent_sock.recv(8192)
+            except BlockingIOError:
+                break
+            if b'SUBSYSTEM=power_supply' in message:
+                relevant = True
+                if message.startswith((b'add@', b'remove@')):
+                    self.rescan()
+        if relevant:
+            self.update()
+        return True
+
+    def rescan(self):
+        for battery in self.batteries:
+            battery.close()
+        self.batteries = find_batteries()
+
+    def read(self):
+        readings = []
+        for battery in self.batteries:
+            try:
+                capacity, status = battery.read()
+            except (OSError, ValueError):
+                continue
+            readings.append((battery.name, capacity, status))
+        return readings
+
+    def update(self):
+        """re-read the batteries, returns whether anything changed."""
+        readings = self.read()
+        if readings == self.readings:
+            return False
+        self.readings = readings
+        self.callback(readings)
+        return True
+
+    def schedule(self):
+        self.timeout_source = scheduler.default().add(self.on_timeout, self.interval)
+
+    def on_timeout(self):
+        # poll more often right after a change, back off while nothing happens
+        if self.update():
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        self.timeout_source.interval = self.interval
+
+def format_readings(readings):
+    """e.g. 'BAT 85% 97%+', a '+' marks a charging battery."""
+    parts = []
+    for _, capacity, status in readings:
+        if capacity == 0: # empty slots / dead batteries, like acpi | grep -v ' 0%'
+            continue
+        parts.append(f"{capacity}%" + ('+' if status == 'Charging' else ''))
+    return 'BAT ' + ' '.join(parts)
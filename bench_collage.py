@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""time adding tiles to collage.ImageGridWidget, to check that it scales linearly.
+
+  bench_collage.py [N ...]    default: 100 1000 5000 20000
+
+for each N, tiles are added with add_images and with add_image one at a
+time, and the time until the window is laid out is printed along with the
+time per tile, which should stay about the same as N grows."""
+import os
+import sys
+import time
+import tempfile
+
+import gi
+gi.require_version('Gtk', '3.0')
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import Gtk, GdkPixbuf
+
+def settle():
+    while Gtk.events_pending():
+        Gtk.main_iteration_do(False)
+
+def bench(window, count, image_path, bulk):
+    grid = collage.ImageGridWidget()
+    window.add(grid)
+    window.show_all()
+    settle()
+    images = [(image_path, f"image {i}") for i in range(count)]
+    start = time.perf_counter()
+    if bulk:
+        grid.add_images(images)
+    else:
+        for image_path, title in images:
+            grid.add_image(image_path, title)
+    settle()
+    elapsed = time.perf_counter() - start
+    grid.cancel_loading()
+    window.remove(grid)
+    grid.destroy()
+    return elapsed
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 5000, 20000]
+    if not Gtk.init_check()[0]:
+        sys.exit("bench_collage.py needs a display, e.g. run it under xvfb-run")
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["XDG_CACHE_HOME"] = tmp # don't fill the real thumbnail cache
+        import collage
+
+        image_path = os.path.join(tmp, "tile.png")
+        pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8, 64, 64)
+        pixbuf.fill(0x3366ccff)
+        pixbuf.savev(image_path, 'png', [], [])
+
+        window = Gtk.OffscreenWindow()
+        window.set_default_size(600, 400)
+        print(f"{'tiles':>8} {'add_images':>12} {'per tile':>10} {'add_image':>12} {'per tile':>10}")
+        for count in counts:
+            bulk = bench(window, count, image_path, True)
+            single = bench(window, count, image_path, False)
+            print(f"{count:>8} {bulk:>11.3f}s {bulk / count * 1e6:>8.1f}us"
+                  f" {single:>11.3f}s {single / count * 1e6:>8.1f}us")
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""talk to a running daemon.py.
+
+  client.py [--match MODE]    same as menu.py: items on stdin, the selection on stdout
+  client.py --source apps     same as menu.py: pick an application (or 'path', an executable)
+  client.py popup             toggle the system popup menu
+
+gtk isn't imported here, so starting the client is cheap. the arguments are
+checked here too, so usage errors and --help end up on the client's
+terminal. when no daemon is running, menu requests fall back to running
+menu.py."""
+import os
+import sys
+import json
+import stat
+import socket
+import selectors
+
+import menu_args
+
+SOCKET_PATH = os.path.join(os.getenv("XDG_RUNTIME_DIR", "/tmp"), "widgets.sock")
+
+def connect(path=SOCKET_PATH):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+def send_file(sock, payload):
+    try:
+        while True:
+            chunk = os.read(payload.fileno(), 65536)
+            if not chunk:
+                break
+            sock.sendall(chunk)
+        sock.shutdown(socket.SHUT_WR)
+    except (BrokenPipeError, ConnectionResetError): # the daemon answered and stopped reading
+        pass
+
+def request(sock, command, payload=None):
+    """send a command, a list like ['menu', '--match', 'substring'] (and optionally
+    the contents of a file) and return the daemon's reply.
+
+    the payload is streamed while watching for the reply, so the daemon can
+    answer (e.g. the user picked an item) before all of it was sent. a regular
+    file (e.g. `client.py < items.txt`) can't be watched, epoll refuses it,
+    but it never blocks either, so it is sent in one go before the reply is read."""
+    sock.sendall(json.dumps(command).encode() + b'\n') # one line, arguments may contain spaces
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    if payload is not None and stat.S_ISREG(os.fstat(payload.fileno()).st_mode):
+        send_file(sock, payload)
+    elif payload is not None:
+        selector.register(payload, selectors.EVENT_READ)
+    else:
+        sock.shutdown(socket.SHUT_WR)
+    chunks = []
+    done = False
+    while not done:
+        for key, _ in selector.select():
+            if key.fileobj is sock:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    done = True
+                    break
+                chunks.append(chunk)
+                continue
+            chunk = os.read(payload.fileno(), 65536)
+            try:
+                if chunk:
+                    sock.sendall(chunk)
+                    continue
+                sock.shutdown(socket.SHUT_WR)
+            except (BrokenPipeError, ConnectionResetError): # the daemon answered and stopped reading
+                pass
+            selector.unregister(payload)
+    selector.close()
+    sock.close()
+    return b''.join(chunks)
+
+def main(argv):
+    command = 'popup' if argv[1:] == ['popup'] else 'menu'
+    if command == 'menu':
+        menu_args.parse_args(argv[1:]) # exits with the usage on bad arguments or --help
+    sock = connect()
+    if sock is None:
+        if command == 'menu': # no daemon, do it the slow way
+            menu = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'menu.py')
+            os.execv(sys.executable, [sys.executable, menu, *argv[1:]])
+        print(f"no daemon listening on {SOCKET_PATH}", file=sys.stderr)
+        return 1
+    if command == 'menu':
+        # like menu.py, a terminal on stdin means there are no items to send
+        payload = None if sys.stdin.isatty() else sys.stdin
+        # menu.py's arguments are passed along, e.g. ['menu', '--match', 'substring']
+        reply = request(sock, [command, *argv[1:]], payload)
+        sys.stdout.buffer.write(reply)
+    else:
+        request(sock, [command])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,11 +1,108 @@
+import array
+
 import gi
-from gi.repository import Gtk, GdkPixbuf
+from gi.repository import Gtk, GLib
 from gi.repository import Pango
 
+import thumbnails
+
+THUMBNAIL_SIZE = 100
+COLUMNS = 4
+SPACING = 10
+OVERSCAN = 2 # rows realized above and below the viewport
+PIXBUF_CACHE_BYTES = 64 * 1024 * 1024
+
+class Item:
+    """an image in the collection."""
+
+    __slots__ = ('path', 'title')
+
+    def __init__(self, path, title):
+        self.path = path
+        self.title = title
+
+class Tile:
+    """the widgets showing one item, recycled for other items while scrolling."""
+
+    __slots__ = ('widget', 'image', 'label', 'index')
+
+    def __init__(self, widget, image, label):
+        self.widget = widget
+        self.image = image
+        self.label = label
+        self.index = None # into items, of the item shown
+
+class TitleIndex:
+    """finds the titles containing a string, case-insensitively, by trigrams.
+
+    a query of three or more chars is only checked against the titles that
+    contain its rarest trigram. a query extending the previous one (another
+    char was typed) is only checked against the previous matches. titles are
+    lowercased once when added; `index` is meant to be run in the background
+    and titles it hasn't got to yet are checked one by one."""
+
+    def __init__(self):
+        self.titles = [] # lowercased
+        self.trigrams = {} # trigram -> array of ids, ascending
+        self.indexed = 0
+        self.last_query = None
+        self.last_matches = None
+        self.last_size = 0 # number of titles last_matches covers
+
+    def add(self, title):
+        self.titles.append(title.lower())
+
+    def index(self, limit=None):
+        """index up to limit more titles, returns whether all of them are indexed now."""
+        trigrams = self.trigrams
+        end = len(self.titles) if limit is None else min(len(self.titles), self.indexed + limit)
+        for i in range(self.indexed, end):
+            title = self.titles[i]
+            for gram in {title[j:j + 3] for j in range(len(title) - 2)}:
+                ids = trigrams.get(gram)
+                if ids is None:
+                    ids = trigrams[gram] = array.array('L')
+                ids.append(i)
+        self.indexed = end
+        return end == len(self.titles)
+
+    def candidates(self, query):
+        if self.last_query is not None and query.startswith(self.last_query):
+            return self.last_matches + list(range(self.last_size, len(self.titles)))
+        if len(query) < 3 or not self.indexed:
+            return range(len(self.titles))
+        grams = {query[j:j + 3] for j in range(len(query) - 2)}
+        rarest = min((self.trigrams.get(gram, ()) for gram in grams), key=len)
+        return list(rarest) + list(range(self.indexed, len(self.titles)))
+
+    def search(self, query):
+        """ids of the titles containing query, ascending."""
+        query = query.lower()
+        if not query:
+            self.last_query = None
+            return range(len(self.titles))
+        titles = self.titles
+        matches = [i for i in self.candidates(query) if query in titles[i]]
+        self.last_query, self.last_matches, self.last_size = query, matches, len(titles)
+        return matches
+
+    def matches(self, i, query):
+        return query.lower() in self.titles[i]
+
 class ImageGridWidget(Gtk.Box):
     def __init__(self):
         super().__init__(orientation=Gtk.Orientation.VERTICAL, spacing=10)
 
+        # thumbnails are decoded in the background, only for the items near the viewport
+        self.loader = thumbnails.ThumbnailLoader(self.on_thumbnails_loaded, THUMBNAIL_SIZE,
+                                                 cache=thumbnails.default_cache())
+        self.pixbufs = thumbnails.PixbufCache(PIXBUF_CACHE_BYTES) # item index -> pixbuf
+        self.failed = set() # item indices that couldn't be decoded
+        self.requested = set() # item indices being loaded
+        self.update_pending = False # a full re-layout is queued for the next frame
+        self.index_source = None
+        self.connect("destroy", self.on_destroy)
+
         # Search bar
         self.search_entry = Gtk.SearchEntry()
         self.search_entry.set_placeholder_text("Search by title...")
@@ -17,22 +114,51 @@ class ImageGridWidget(Gtk.Box):
         self.scrolled_window.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
         self.pack_start(self.scrolled_window, True, True, 0)
 
-        # Grid to hold images and titles
-        self.grid = Gtk.Grid()
-        self.grid.set_row_spacing(10)
-        self.grid.set_column_spacing(10)
-        self.scrolled_window.add(self.grid)
+        # the grid is virtualized: only the tiles for the rows in view (plus
+        # OVERSCAN) exist, placed on a layout as tall as all rows and rebound to
+        # other items as it scrolls
+        self.layout = Gtk.Layout()
+        self.layout.get_vadjustment().connect("value-changed", lambda adjustment: self.update_visible())
+        # changing children during size-allocate would re-enter it
+        self.layout.connect("size-allocate", lambda widget, allocation: self.queue_update_grid())
+        self.scrolled_window.add(self.layout)
+        self.tiles = [] # ring of tiles, the one for position p is tiles[p % len(tiles)]
+        self.tile_size = None # (width, height) including spacing, measured from the first tile
 
         # Internal data structure to keep track of items
-        self.items = []  # Each item is a tuple (widget, title)
+        self.items = []  # Items, in the order they were added
+        self.index = TitleIndex() # of the items' titles, by item index
+        self.shown = [] # indices into items of those matching the search, in grid order
 
     def add_image(self, image_path, title):
-        # Create image widget
-        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(image_path, 100, 100, preserve_aspect_ratio=True)
-        image = Gtk.Image.new_from_pixbuf(pixbuf)
+        self.add_images([(image_path, title)])
+
+    def add_images(self, images):
+        """add (image_path, title) pairs after the others. widgets are only made for the ones in view."""
+        search_text = self.search_entry.get_text()
+        for image_path, title in images:
+            self.index.add(title)
+            if self.index.matches(len(self.items), search_text):
+                self.shown.append(len(self.items))
+            self.items.append(Item(image_path, title))
+        self.queue_update_grid()
+        if self.index_source is None:
+            self.index_source = GLib.idle_add(self.index_titles, priority=GLib.PRIORITY_LOW)
+
+    def index_titles(self):
+        # a slice at a time, so the main loop stays responsive
+        if self.index.index(limit=200):
+            self.index_source = None
+            return False
+        return True
+
+    def create_tile(self):
+        # Create image widget, a fixed-size placeholder until the thumbnail is in
+        image = Gtk.Image()
+        image.set_size_request(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
 
         # Create label
-        label = Gtk.Label(label=title)
+        label = Gtk.Label()
         label.set_ellipsize(Pango.EllipsizeMode.END)
         label.set_max_width_chars(15)
         label.set_xalign(0.5)
@@ -45,39 +171,139 @@ class ImageGridWidget(Gtk.Box):
         # Add event box for handling mouse events
         event_box = Gtk.EventBox()
         event_box.add(container)
-        event_box.connect("enter-notify-event", self.on_mouse_hover, title)
-        event_box.connect("button-press-event", self.on_mouse_click, title)
+        tile = Tile(event_box, image, label)
+        event_box.connect("enter-notify-event", self.on_mouse_hover, tile)
+        event_box.connect("button-press-event", self.on_mouse_click, tile)
+        event_box.show_all()
+        return tile
 
-        # Add to grid
-        self.items.append((event_box, title))
-        self.update_grid()
+    def measure(self):
+        # tiles are all the same size, the label is ellipsized
+        tile = self.create_tile()
+        tile.label.set_text("measure")
+        self.layout.put(tile.widget, 0, 0)
+        _, natural = tile.widget.get_preferred_size()
+        self.tile_size = (natural.width + SPACING, natural.height + SPACING)
+        tile.widget.hide()
+        self.tiles.append(tile)
 
-    def update_grid(self):
-        # Clear the grid
-        for child in self.grid.get_children():
-            self.grid.remove(child)
+    def bind(self, tile, index):
+        """show item index on tile, loading its thumbnail if needed."""
+        if tile.index == index:
+            return
+        tile.index = index
+        item = self.items[index]
+        tile.label.set_text(item.title)
+        pixbuf = self.pixbufs.get(index)
+        if pixbuf is not None:
+            tile.image.set_from_pixbuf(pixbuf)
+        elif index in self.failed:
+            tile.image.set_from_icon_name("image-missing", Gtk.IconSize.DIALOG)
+        else:
+            tile.image.set_from_icon_name("image-loading", Gtk.IconSize.DIALOG)
+            if index not in self.requested:
+                self.requested.add(index)
+                self.loader.request(index, item.path)
 
-        # Add filtered items back to the grid
-        for i, (widget, _) in enumerate(self.items):
-            self.grid.attach(widget, i % 4, i // 4, 1, 1)  # 4 items per row
+    def on_thumbnails_loaded(self, loaded):
+        for index, pixbuf in loaded:
+            self.requested.discard(index)
+            if pixbuf is None:
+                self.failed.add(index)
+            else:
+                self.pixbufs.put(index, pixbuf)
+        # the tiles still showing these items get their thumbnail
+        loaded = dict(loaded)
+        for tile in self.tiles:
+            if tile.index in loaded:
+                if loaded[tile.index] is None:
+                    tile.image.set_from_icon_name("image-missing", Gtk.IconSize.DIALOG)
+                else:
+                    tile.image.set_from_pixbuf(loaded[tile.index])
 
-        self.grid.show_all()
+    def update_visible(self):
+        """bind the tiles to the items in the rows between the viewport's edges, plus overscan."""
+        if self.tile_size is None:
+            self.measure()
+        width, height = self.tile_size
+        adjustment = self.layout.get_vadjustment()
+        first_row = max(0, int(adjustment.get_value() // height) - OVERSCAN)
+        rows = int(adjustment.get_page_size() // height) + 2 + 2 * OVERSCAN
+        # enough tiles for the viewport, made once and reused
+        while len(self.tiles) < rows * COLUMNS:
+            tile = self.create_tile()
+            self.layout.put(tile.widget, 0, 0)
+            self.tiles.append(tile)
+        first = first_row * COLUMNS
+        last = min(len(self.shown), first + rows * COLUMNS)
+        high = set()
+        for position in range(first, first + len(self.tiles)):
+            tile = self.tiles[position % len(self.tiles)]
+            if position >= last:
+                tile.index = None
+                tile.widget.hide()
+                continue
+            self.bind(tile, self.shown[position])
+            row, column = divmod(position, COLUMNS)
+            x, y = column * width, row * height
+            if self.layout.child_get(tile.widget, 'x', 'y') != (x, y):
+                self.layout.move(tile.widget, x, y)
+            tile.widget.show()
+            if first + OVERSCAN * COLUMNS <= position < last - OVERSCAN * COLUMNS:
+                high.add(self.shown[position])
+        # drop the loads of items that scrolled out of reach before they were in. that's
+        # only known after the whole pass, a tile may now show another tile's old item
+        bound = {tile.index for tile in self.tiles}
+        stale = self.requested - bound
+        if stale:
+            self.requested -= stale
+            self.loader.cancel(stale)
+        # the rows in view are decoded before the overscan
+        self.loader.prioritize(high & self.requested)
 
-    def on_search_changed(self, search_entry):
-        search_text = search_entry.get_text().lower()
+    def on_destroy(self, widget):
+        self.cancel_loading()
+        if self.index_source is not None:
+            GLib.source_remove(self.index_source)
+            self.index_source = None
 
-        # Filter items based on the search query
-        for widget, title in self.items:
-            if search_text in title.lower():
-                widget.show()
-            else:
-                widget.hide()
+    def cancel_loading(self):
+        """stop decoding thumbnails, the tiles not loaded yet keep their placeholder."""
+        self.loader.cancel()
+        self.requested.clear()
 
-    def on_mouse_hover(self, widget, event, title):
-        print(f"Hovered over: {title}")
+    def queue_update_grid(self):
+        """re-layout the whole grid, at most once per frame."""
+        if self.update_pending:
+            return
+        self.update_pending = True
+        if self.get_realized():
+            self.add_tick_callback(self.update_grid)
+        else:
+            GLib.idle_add(self.update_grid)
 
-    def on_mouse_click(self, widget, event, title):
-        print(f"Clicked on: {title}")
+    def update_grid(self, *args):
+        self.update_pending = False
+        if self.tile_size is None:
+            self.measure()
+        width, height = self.tile_size
+        rows = -(-len(self.shown) // COLUMNS)
+        self.layout.set_size(COLUMNS * width, rows * height)
+        self.update_visible()
+        return False # one-shot
+
+    def on_search_changed(self, search_entry):
+        # Filter items based on the search query, the matches are reflowed from the top
+        # a copy, the index keeps its result for narrowing the next search
+        self.shown = list(self.index.search(search_entry.get_text()))
+        self.layout.get_vadjustment().set_value(0)
+        self.queue_update_grid()
+
+    def on_mouse_hover(self, widget, event, tile):
+        print(f"Hovered over: {self.items[tile.index].title}")
+
+    def on_mouse_click(self, widget, event, tile):
+        print(f"Clicked on: {self.items[tile.index].title}")
 
 # Example usage
 if __name__ == "__main__":
@@ -105,10 +331,9 @@ if __name__ == "__main__":
         ]
 
         for image_path, title in images:
-            if os.path.exists(image_path):
-                image_grid.add_image(image_path, title)
-            else:
+            if not os.path.exists(image_path):
                 print(f"Image not found: {image_path}", file=sys.stderr)
+        image_grid.add_images((image_path, title) for image_path, title in images if os.path.exists(image_path))
 
         window.add(image_grid)
         window.show_all()
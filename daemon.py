@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+import os
+import json
+import socket
+from pathlib import Path
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, Gdk, GLib, Gio
+
+import client
+from bar import SystemBar
+from bar_menu import PopupMenu
+import menu
+from menu import DMenuPopup
+import sources
+import utils
+
+class Connection:
+    """a client connection, read line by line on the main loop.
+
+    the first line is the command, `on_request` is called as soon as it is
+    in. the payload lines that follow are handed to `on_lines` as they arrive
+    (set it from on_request) and `on_eof` is called when the client stops writing."""
+
+    def __init__(self, sock, on_request):
+        self.sock = sock
+        self.on_request = on_request
+        self.on_lines = None
+        self.on_eof = None
+        self.command = None
+        sock.setblocking(False)
+        self.reader = utils.LineReader(sock.fileno(), self.on_reader_lines, self.on_reader_eof)
+
+    def on_reader_lines(self, lines):
+        if self.command is None:
+            self.command, *lines = lines
+            self.on_request(self, self.command)
+        if lines and self.on_lines:
+            self.on_lines(lines)
+
+    def on_reader_eof(self):
+        if self.command is None: # closed before sending anything
+            self.command = ''
+            self.on_request(self, self.command)
+        if self.on_eof:
+            self.on_eof()
+
+    def reply(self, data=b''):
+        self.reader.stop()
+        self.on_lines = self.on_eof = None
+        try:
+            self.sock.setblocking(True)
+            self.sock.sendall(data)
+        except OSError: # the client went away
+            pass
+        self.sock.close()
+
+class Daemon:
+    """hosts the bar plus a pre-built dmenu popup and system popup, driven over a UNIX socket.
+
+    everything is built once at startup, so a request only has to swap the
+    menu's items and show a window. see client.py for the other end."""
+
+    def __init__(self, path=client.SOCKET_PATH):
+        self.path = path
+        self.bar = SystemBar()
+        self.bar.show_all()
+        self.bar.popup = PopupMenu(persistent=True) # built now, not on the first toggle
+
+        self.menu = DMenuPopup(on_done=self.on_menu_done)
+        self.menu.connect("delete-event", lambda *_: self.on_menu_done(None) or True)
+        self.menu.hide()
+        self.menu_connection = None
+
+        if os.path.exists(path): # left behind by a previous daemon
+            os.unlink(path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+        self.server.setblocking(False)
+        GLib.io_add_watch(self.server.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self.on_accept)
+
+    def on_accept(self, fd, condition):
+        try:
+            sock, _ = self.server.accept()
+        except BlockingIOError:
+            return True
+        Connection(sock, self.on_request)
+        return True
+
+    def on_request(self, connection, command):
+        # a json list, e.g. ["menu", "--match", "substring"], see client.request
+        try:
+            command, *args = json.loads(command)
+        except (ValueError, TypeError):
+            connection.reply(f"bad request: {command}\n".encode())
+            return
+        if command == 'menu':
+            try:
+                args = menu.parse_args(args)
+            except SystemExit: # client.py checks the arguments first, this is some other client
+                connection.reply()
+                return
+            # a new menu replaces one that is still open, its client gets no selection
+            if self.menu_connection:
+                self.menu_connection.reply()
+            self.menu_connection = connection
+            if args.source: # the client's stdin is ignored
+                self.menu.show_source(sources.get(args.source), args.match, args.debounce, args.jobs)
+                return
+            # the menu is shown right away, items are streamed in as the client sends them
+            self.menu.loading = True
+            self.menu.show_items([], args.match, args.debounce, jobs=args.jobs)
+            connection.on_lines = self.menu.add_items
+            connection.on_eof = self.menu.finish_items
+        elif command == 'popup':
+            self.bar.toggle_popup()
+            connection.reply()
+        else:
+            connection.reply(f"unknown command: {command}\n".encode())
+
+    def on_menu_done(self, item):
+        self.menu.hide()
+        connection, self.menu_connection = self.menu_connection, None
+        if connection:
+            connection.reply(b'' if item is None else item.encode() + b'\n')
+
+    def close(self):
+        self.server.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+if __name__ == "__main__":
+    css_provider = Gtk.CssProvider()
+    css_provider.load_from_file(Gio.File.new_for_path(str(Path(__file__).with_name('main.css'))))
+    Gtk.StyleContext.add_provider_for_screen(
+        Gdk.Screen.get_default(), css_provider, Gtk.STYLE_PROVIDER_PRIORITY_USER
+    )
+
+    daemon = Daemon()
+    daemon.bar.connect("destroy", Gtk.main_quit)
+    try:
+        Gtk.main()
+    finally:
+        daemon.close()
@@ -0,0 +1,151 @@
+import os
+import mmap
+import time
+import array
+import bisect
+import fcntl
+import struct
+import hashlib
+
+# a selection's weight halves every HALF_LIFE seconds
+HALF_LIFE = 14 * 24 * 3600
+# log records before they are merged into the table
+COMPACT_AFTER = 4096
+# entries that decayed below this are dropped when compacting
+MIN_SCORE = 0.01
+
+MAGIC = b'frc1'
+HEADER = struct.Struct('=4sI') # magic, number of entries
+RECORD = struct.Struct('=Qd') # item hash, time of the selection
+
+def default_path():
+    data = os.getenv("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    return os.path.join(data, "widgets", "frecency")
+
+def item_hash(item):
+    return int.from_bytes(hashlib.blake2b(item.encode(errors='replace'), digest_size=8).digest(), 'little')
+
+def decay(score, since, now):
+    return score * 0.5 ** (max(0, now - since) / HALF_LIFE)
+
+class Store:
+    """how often and how recently items were picked, keyed by a hash of the item.
+
+    the table is a file of three sorted columns (hashes, scores, times) that is
+    memory-mapped and binary searched, so loading it costs the same for any
+    number of entries. new selections are appended to a log next to it, which
+    is small and read in full, and merged into the table every COMPACT_AFTER
+    records. a score is the number of selections, each decayed by its age."""
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        self.log_path = self.path + ".log"
+        self.table = ((), (), ()) # hashes, scores, times; swapped as a whole, lookups run on other threads
+        self.recent = {} # hash -> (score, time of the last selection), from the log
+        self.log_records = 0
+        self.loaded = None
+        self.load()
+
+    def load(self):
+        self.loaded = self.version()
+        self.table = ((), (), ())
+        try:
+            with open(self.path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError): # missing or empty
+            data = None
+        if data is not None and len(data) >= HEADER.size:
+            magic, count = HEADER.unpack_from(data)
+            if magic == MAGIC and len(data) >= HEADER.size + 24 * count:
+                view = memoryview(data)[HEADER.size:HEADER.size + 24 * count]
+                self.table = (view[:8 * count].cast('Q'),
+                              view[8 * count:16 * count].cast('d'),
+                              view[16 * count:].cast('d'))
+        recent = {}
+        try:
+            with open(self.log_path, 'rb') as f:
+                log = f.read()
+        except FileNotFoundError:
+            log = b''
+        log = log[:len(log) - len(log) % RECORD.size] # a record cut short by a crash
+        for key, when in RECORD.iter_unpack(log):
+            score, last = recent.get(key, (0.0, when))
+            recent[key] = (decay(score, last, when) + 1, max(last, when))
+        self.recent = recent
+        self.log_records = len(log) // RECORD.size
+
+    def version(self):
+        try:
+            return tuple((s.st_ino, s.st_size, s.st_mtime_ns) for s in map(os.stat, (self.path, self.log_path)))
+        except FileNotFoundError:
+            return None
+
+    def refresh(self):
+        """pick up selections made by other processes since loading."""
+        if self.version() != self.loaded:
+            self.load()
+
+    def __len__(self):
+        return len(self.table[0]) + len(self.recent)
+
+    def lookup(self, key):
+        """(score, time of the last selection) for a hash."""
+        hashes, scores, times = self.table
+        i = bisect.bisect_left(hashes, key)
+        if i < len(hashes) and hashes[i] == key:
+            score, last = scores[i], times[i]
+        else:
+            score, last = 0.0, 0.0
+        recent = self.recent.get(key)
+        if recent is not None: # the log's scores start from zero, add the table's as of then
+            score, last = decay(score, last, recent[1]) + recent[0], recent[1]
+        return score, last
+
+    def score(self, item, now=None):
+        score, last = self.lookup(item_hash(item))
+        return decay(score, last, now or time.time()) if score else 0.0
+
+    def record(self, item, when=None):
+        key, when = item_hash(item), when or time.time()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.log_path, 'ab') as log:
+            fcntl.flock(log, fcntl.LOCK_SH) # keeps compaction in another process from truncating it under us
+            log.write(RECORD.pack(key, when))
+        score, last = self.recent.get(key, (0.0, when))
+        self.recent[key] = (decay(score, last, when) + 1, max(last, when))
+        self.log_records += 1
+        if self.log_records >= COMPACT_AFTER:
+            self.compact()
+
+    def compact(self):
+        """merge the log into the table, dropping entries that decayed to nothing."""
+        now = time.time()
+        with open(self.log_path, 'ab') as log:
+            fcntl.flock(log, fcntl.LOCK_EX)
+            self.load() # including what other processes logged
+            hashes, scores, times = self.table
+            merged = dict(zip(hashes, zip(scores, times)))
+            for key in self.recent:
+                merged[key] = self.lookup(key)
+            entries = sorted((key, score, last) for key, (score, last) in merged.items()
+                             if decay(score, last, now) >= MIN_SCORE)
+            columns = (array.array('Q', [e[0] for e in entries]),
+                       array.array('d', [e[1] for e in entries]),
+                       array.array('d', [e[2] for e in entries]))
+            tmp = self.path + ".tmp"
+            with open(tmp, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, len(entries)))
+                for column in columns:
+                    f.write(column.tobytes())
+            os.replace(tmp, self.path)
+            log.truncate(0)
+        self.load()
+
+_default = None
+
+def default():
+    """return the shared store."""
+    global _default
+    if _default is None:
+        _default = Store()
+    return _default
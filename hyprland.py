@@ -1,37 +1,426 @@
 import os
+import sys
+import json
+import time
 import socket
 import threading
+from typing import NamedTuple, Optional
+
+from gi.repository import GLib
 
 # λ socat -U - UNIX-CONNECT:$XDG_RUNTIME_DIR/hypr/$HYPRLAND_INSTANCE_SIGNATURE/.socket2.sock | while read -r line; do echo "$line"; done
 
-listeners = []
+def socket_paths(name):
+    """return the paths of one of hyprland's sockets, e.g. '.socket.sock' or '.socket2.sock',
+    in every instance that has it: ours first, then the others, newest first.
+
+    hyprland gets a new instance signature when it restarts, while our
+    environment keeps the one it was started with."""
+    runtime = os.path.join(os.getenv("XDG_RUNTIME_DIR", ""), "hypr")
+    own = os.getenv("HYPRLAND_INSTANCE_SIGNATURE", "")
+    found = []
+    try:
+        with os.scandir(runtime) as it:
+            for entry in it:
+                path = os.path.join(entry.path, name)
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except OSError:
+                    continue
+                found.append((entry.name != own, -mtime, path))
+    except OSError:
+        pass
+    return [path for _, _, path in sorted(found)]
+
+def connect(name, preferred=None, timeout=None):
+    """connect to one of hyprland's sockets, return (socket, path).
+
+    preferred (the path that worked last time) is tried first, then the ones
+    from socket_paths. a socket left behind by an instance that crashed
+    refuses the connection, so the next one is tried."""
+    paths = socket_paths(name)
+    if preferred is not None:
+        paths = [preferred] + [path for path in paths if path != preferred]
+    error = FileNotFoundError(f"no hyprland instance has {name}")
+    for path in paths:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(path)
+        except OSError as e:
+            sock.close()
+            error = e
+            continue
+        return sock, path
+    raise error
+
+class Workspace(NamedTuple):
+    id: int
+    name: str
+    monitor: str
+    windows: int
+
+    @classmethod
+    def from_json(cls, obj):
+        return cls(int(obj['id']), obj.get('name', str(obj['id'])),
+                   obj.get('monitor', ''), int(obj.get('windows', 0)))
+
+class Monitor(NamedTuple):
+    id: int
+    name: str
+    focused: bool
+    active_workspace: int
+
+    @classmethod
+    def from_json(cls, obj):
+        return cls(int(obj['id']), obj['name'], bool(obj.get('focused', False)),
+                   int(obj.get('activeWorkspace', {}).get('id', -1)))
+
+class HyprlandError(Exception):
+    pass
+
+class Client:
+    """talks to hyprland's request socket (.socket.sock) without spawning hyprctl.
+
+    hyprland answers one request per connection and then closes it, so every
+    call is a single connect/send/read round trip. use `batch` to make several
+    requests share one round trip."""
+
+    def __init__(self, path=None, timeout=1.0):
+        self.fixed = path is not None # otherwise follow hyprland to a new instance when it restarts
+        self.path = path
+        self.timeout = timeout
+
+    def connect(self):
+        if self.fixed:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(self.timeout)
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            return sock
+        sock, self.path = connect(".socket.sock", self.path, self.timeout)
+        return sock
+
+    def request(self, command):
+        """send a raw request and return the raw reply as a string."""
+        with self.connect() as sock:
+            sock.sendall(command.encode())
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return b''.join(chunks).decode()
+
+    def query(self, what):
+        """run a json query (e.g. 'workspaces') and return the decoded reply."""
+        return json.loads(self.request(f"j/{what}"))
+
+    def batch(self, *commands):
+        """run several requests in one round trip, returning one reply per command.
+
+        json queries must be given with their 'j/' prefix and are decoded,
+        everything else (dispatches, keywords) is returned as a stripped string."""
+        if not commands:
+            return []
+        reply = self.request("[[BATCH]]" + ";".join(commands))
+        return split_batch_reply(reply, commands)
+
+    def dispatch(self, dispatcher, *args):
+        """run a dispatcher, e.g. dispatch('workspace', 3)."""
+        command = " ".join(["dispatch", dispatcher, *map(str, args)])
+        reply = self.request(command).strip()
+        if reply != "ok":
+            raise HyprlandError(reply)
+
+def split_batch_reply(reply, commands):
+    """split the concatenated reply of a [[BATCH]] request into one part per command."""
+    decoder = json.JSONDecoder()
+    results = []
+    pos = 0
+    for command in commands:
+        # replies may or may not be separated by whitespace depending on the hyprland version
+        while pos < len(reply) and reply[pos].isspace():
+            pos += 1
+        if command.startswith("j/"):
+            obj, pos = decoder.raw_decode(reply, pos)
+            results.append(obj)
+        elif reply.startswith("ok", pos):
+            results.append("ok")
+            pos += 2
+        else:
+            end = reply.find("\n", pos)
+            end = len(reply) if end == -1 else end
+            results.append(reply[pos:end].strip())
+            pos = end
+    return results
+
+def is_special(ws_id, name):
+    """special workspaces (scratchpads) have negative ids, e.g. -98 'special:magic'."""
+    return ws_id < 0 or name.startswith('special:')
+
+class WorkspaceModel:
+    """in-memory view of hyprland's workspaces, kept current from socket2 events.
+
+    `sync` does a full re-sync through the request socket and is only needed at
+    startup and after reconnecting; between those, `apply` updates the model
+    from single events. `apply` returns whether anything visible changed.
+    special workspaces are left out, they aren't switched to by id."""
+
+    def __init__(self):
+        self.workspaces = {} # id -> Workspace
+        self.monitors = {} # monitor name -> active workspace id
+        self.focused_monitor = None
+
+    @property
+    def active(self):
+        return self.monitors.get(self.focused_monitor)
+
+    def ids(self):
+        return sorted(self.workspaces)
+
+    def sync(self, client):
+        workspaces, monitors = client.batch("j/workspaces", "j/monitors")
+        self.workspaces = {w.id: w for w in map(Workspace.from_json, workspaces)
+                           if not is_special(w.id, w.name)}
+        self.monitors = {}
+        self.focused_monitor = None
+        for monitor in map(Monitor.from_json, monitors):
+            self.monitors[monitor.name] = monitor.active_workspace
+            if monitor.focused:
+                self.focused_monitor = monitor.name
+
+    def _lookup(self, name):
+        """map a workspace name from a v1 event to its id."""
+        for workspace in self.workspaces.values():
+            if workspace.name == name:
+                return workspace.id
+        try:
+            return int(name)
+        except ValueError:
+            return None
+
+    def apply(self, event, data):
+        """update the model from one socket2 event, e.g. apply('workspace', '3')."""
+        before = (self.ids(), self.active)
+        if event == 'createworkspacev2':
+            ws_id, name = data.split(',', 1)
+            self._add(int(ws_id), name)
+        elif event == 'createworkspace':
+            ws_id = self._lookup(data)
+            if ws_id is not None:
+                self._add(ws_id, data)
+        elif event in ('destroyworkspacev2', 'destroyworkspace'):
+            ws_id = int(data.split(',', 1)[0]) if event.endswith('v2') else self._lookup(data)
+            self.workspaces.pop(ws_id, None)
+        elif event in ('workspacev2', 'workspace'):
+            ws_id = int(data.split(',', 1)[0]) if event.endswith('v2') else self._lookup(data)
+            if ws_id is not None:
+                self.monitors[self.focused_monitor] = ws_id
+        elif event in ('focusedmonv2', 'focusedmon'):
+            monitor, workspace = data.split(',', 1)
+            ws_id = int(workspace) if event.endswith('v2') else self._lookup(workspace)
+            self.focused_monitor = monitor
+            if ws_id is not None:
+                self.monitors[monitor] = ws_id
+        elif event in ('moveworkspacev2', 'moveworkspace'):
+            if event.endswith('v2'):
+                ws_id, _, monitor = data.split(',', 2)
+                ws_id = int(ws_id)
+            else:
+                name, monitor = data.rsplit(',', 1)
+                ws_id = self._lookup(name)
+            if ws_id in self.workspaces:
+                self.workspaces[ws_id] = self.workspaces[ws_id]._replace(monitor=monitor)
+        return before != (self.ids(), self.active)
+
+    def _add(self, ws_id, name):
+        if ws_id not in self.workspaces and not is_special(ws_id, name):
+            self.workspaces[ws_id] = Workspace(ws_id, name, self.focused_monitor or '', 0)
+
+class EventCoalescer:
+    """collects events from the listener thread and hands them to the main loop in batches.
+
+    events arriving within `window` seconds (one frame by default) are delivered
+    as a single list of (event, data) pairs to `callback` on the main loop.
+    events that only describe the latest state (see REPLACING) replace earlier
+    ones about the same thing within a batch (see `replace_key`), events not in
+    `events` are dropped."""
+
+    # events whose newest occurrence makes earlier ones in the same batch irrelevant
+    REPLACING = {
+        'workspace', 'workspacev2', 'focusedmon', 'focusedmonv2',
+        'activewindow', 'activewindowv2', 'activelayout', 'activespecial',
+        'submap', 'fullscreen',
+    }
+
+    def __init__(self, callback, window=1 / 60, events=None):
+        self.callback = callback
+        self.window = window
+        self.events = events
+        self.lock = threading.Lock()
+        self.pending = []
+        self.latest = {} # replace_key -> index into pending
+        self.focus_moves = 0 # focusedmon events in the batch so far
+        self.scheduled = False
+        # counters
+        self.received = 0
+        self.dropped = 0
+        self.merged = 0
+        self.delivered = 0
+        self.batches = 0
+
+    def push(self, event, data):
+        """queue an event, can be called from any thread."""
+        with self.lock:
+            self.received += 1
+            if self.events is not None and event not in self.events:
+                self.dropped += 1
+                return
+            key = self.replace_key(event, data)
+            if key is not None:
+                index = self.latest.get(key)
+                if index is not None:
+                    self.pending[index] = None
+                    self.merged += 1
+                self.latest[key] = len(self.pending)
+            if event in ('focusedmon', 'focusedmonv2'):
+                self.focus_moves += 1
+            self.pending.append((event, data))
+            if not self.scheduled:
+                self.scheduled = True
+                GLib.timeout_add(max(1, int(self.window * 1000)), self._flush)
+
+    def replace_key(self, event, data):
+        """what an event is about, it replaces earlier ones with the same key. None if it doesn't."""
+        if event not in self.REPLACING:
+            return None
+        if event in ('focusedmon', 'focusedmonv2'):
+            # 'monitor,workspace' also tells that monitor's active workspace, keep one per monitor
+            return event, data.split(',', 1)[0]
+        if event in ('workspace', 'workspacev2'):
+            # about the focused monitor, which changes with every focusedmon
+            return event, self.focus_moves
+        return event
+
+    def push_event(self, event):
+        self.push(event.name, event.data)
+
+    def _flush(self):
+        with self.lock:
+            batch = [item for item in self.pending if item is not None]
+            self.pending = []
+            self.latest = {}
+            self.focus_moves = 0
+            self.scheduled = False
+            self.delivered += len(batch)
+            self.batches += 1
+        if batch:
+            self.callback(batch)
+        return False # one-shot
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'dropped': self.dropped,
+            'merged': self.merged,
+            'delivered': self.delivered,
+            'batches': self.batches,
+        }
+
+_client: Optional[Client] = None
+
+def client():
+    """return the shared request-socket client."""
+    global _client
+    if _client is None:
+        _client = Client()
+    return _client
+
+class Event:
+    """a parsed socket2 event, e.g. 'workspacev2>>3,3' -> Event('workspacev2', '3,3')."""
+    __slots__ = ('name', 'data')
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+    def args(self, maxsplit=-1):
+        """split the event data into its comma separated fields."""
+        return self.data.split(',', maxsplit)
+
+    def __repr__(self):
+        return f"Event({self.name!r}, {self.data!r})"
+
+subscribers = {} # event name -> list of callbacks
+connect_listeners = []
+_thread = None
+_lock = threading.Lock()
+
+def on(name, callback):
+    """call callback(event) from the listener thread for every event called `name`.
+
+    the listener thread is started on the first subscription."""
+    subscribers.setdefault(name, []).append(callback)
+    _ensure_started()
+
+def off(name, callback):
+    callbacks = subscribers.get(name, [])
+    if callback in callbacks:
+        callbacks.remove(callback)
+
+def on_connect(callback):
+    """call callback() from the listener thread whenever the event socket is (re)connected."""
+    connect_listeners.append(callback)
+    _ensure_started()
 
 def handle(event_line):
-    for listener in listeners:
-        listener(event_line.strip())
-
-def main():
-    # get the socket path from environment variables
-    hypr_socket_path = os.path.join(
-        os.getenv("XDG_RUNTIME_DIR", ""),
-        "hypr",
-        os.getenv("HYPRLAND_INSTANCE_SIGNATURE", ""),
-        ".socket2.sock"
-    )
-
-    # ensure the socket path exists
-    if not os.path.exists(hypr_socket_path):
-        raise FileNotFoundError(f"socket not found at {hypr_socket_path}")
-
-    # connect to the UNIX socket
-    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
-        sock.connect(hypr_socket_path)
-        with sock.makefile('r') as f: # read socket as a file-like object
-            for line in f:
-                handle(line.strip()) # pass each line to the handler
-
-def add_listener(func):
-    listeners.append(func)
-
-thread = threading.Thread(target=main, args=())
-thread.start()
\ No newline at end of file
+    name, _, data = event_line.partition('>>')
+    callbacks = subscribers.get(name)
+    if not callbacks: # nobody cares, don't build an event
+        return
+    event = Event(name, data)
+    for callback in callbacks:
+        callback(event)
+
+def listen(sock):
+    """read events from a connected socket2 until hyprland closes it."""
+    for listener in connect_listeners:
+        listener()
+    with sock.makefile('r') as f: # read socket as a file-like object
+        for line in f:
+            handle(line.rstrip('\n')) # pass each line to the handler
+
+def main(min_backoff=0.5, max_backoff=30):
+    """connect to socket2 and dispatch events, reconnecting with backoff when hyprland restarts."""
+    backoff = min_backoff
+    reported = False # only the first failure since the last connection is reported
+    path = None
+    while True:
+        try:
+            sock, path = connect(".socket2.sock", path)
+        except OSError as e:
+            if not reported:
+                print(f"hyprland: cannot read events: {e}", file=sys.stderr)
+                reported = True
+        else:
+            backoff = min_backoff
+            reported = False
+            with sock:
+                try:
+                    listen(sock)
+                except OSError as e:
+                    print(f"hyprland: lost the event socket {path}: {e}", file=sys.stderr)
+        time.sleep(backoff)
+        backoff = min(backoff * 2, max_backoff)
+
+def _ensure_started():
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=main, daemon=True, name="hyprland-events")
+            _thread.start()
@@ -0,0 +1,297 @@
+import re
+import math
+import heapq
+import threading
+import unicodedata
+
+SUBSTRING = 'substring'
+FUZZY = 'fuzzy'
+MODES = (SUBSTRING, FUZZY)
+
+# scores, loosely following fzf
+SCORE_MATCH = 16
+BONUS_BOUNDARY = 8 # matched char starts a word
+BONUS_FIRST_CHAR = 8 # extra for matching the very first char of the item
+BONUS_CONSECUTIVE = 4 # matched char directly follows the previous one
+PENALTY_GAP_START = 3
+PENALTY_GAP_EXTENSION = 1
+# per doubling of an item's frecency (see frecency.py), so a few picks beat a slightly better match
+BONUS_FRECENCY = 8
+
+# items scanned between checks for cancellation
+CHUNK_SIZE = 4096
+
+SEPARATORS = frozenset(' /\\-_.,:;|()[]{}\'"')
+
+def normalize(text):
+    """lowercase and strip accents, so 'Émacs' matches 'emacs'."""
+    text = text.lower()
+    if text.isascii():
+        return text
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+def is_boundary(text, i):
+    return i == 0 or text[i - 1] in SEPARATORS
+
+def fuzzy_pattern(query):
+    """a regex for re.match that matches text containing query's chars in order.
+
+    every gap only skips chars other than the next one, so the earliest
+    occurrence is taken and nothing is ever retried: a failed match costs one
+    pass over the text, where '.*?' gaps would backtrack through every
+    placement of the earlier chars."""
+    return ''.join(f'[^{char}]*{char}' for char in map(re.escape, query))
+
+def fuzzy_positions(text, query):
+    """positions of query's chars in text, choosing a compact match, or None.
+
+    like fzf's v1 algorithm: scan forward for the first complete match, then
+    backward from its end to find the shortest window ending there."""
+    pos = -1
+    for char in query:
+        pos = text.find(char, pos + 1)
+        if pos == -1:
+            return None
+    positions = [pos]
+    for char in reversed(query[:-1]):
+        positions.append(text.rfind(char, 0, positions[-1]))
+    positions.reverse()
+    return positions
+
+def score_positions(text, positions):
+    score = 0
+    previous = None
+    for pos in positions:
+        score += SCORE_MATCH
+        if is_boundary(text, pos):
+            score += BONUS_BOUNDARY
+            if pos == 0:
+                score += BONUS_FIRST_CHAR
+        if previous is not None:
+            gap = pos - previous - 1
+            if gap == 0:
+                score += BONUS_CONSECUTIVE
+            else:
+                score -= PENALTY_GAP_START + PENALTY_GAP_EXTENSION * (gap - 1)
+        previous = pos
+    return score
+
+def score_substring(text, query, pos):
+    score = SCORE_MATCH * len(query) + BONUS_CONSECUTIVE * (len(query) - 1)
+    if is_boundary(text, pos):
+        score += BONUS_BOUNDARY + (BONUS_FIRST_CHAR if pos == 0 else 0)
+    return score - pos # earlier is better
+
+class Cancelled(Exception):
+    pass
+
+class Matcher:
+    """ranks items against a query, substring or fzf-like fuzzy.
+
+    items are normalized once up front. when a query extends the previous one
+    (the user typed another char), only the previous matches are searched,
+    since anything matching the longer query matched the shorter one too.
+    items added since then are searched in full.
+
+    with a frecency store, items picked often and recently get a bonus, and
+    an empty query lists them first. `keys`, if given, is the text matched
+    for each item instead of the item itself (e.g. an app's name and keywords)."""
+
+    def __init__(self, items, mode=FUZZY, frecency=None, keys=None):
+        if mode not in MODES:
+            raise ValueError(f"unknown match mode: {mode}")
+        self.mode = mode
+        self.items = []
+        self.normalized = []
+        self.last_query = None
+        self.last_matches = None # indices of every item matching last_query
+        self.last_size = 0 # number of items last_matches covers
+        self.frecency = frecency if frecency else None # an empty store changes nothing
+        self.boosts = {} # index -> frecency bonus, looked up on demand
+        self.boosted = [] # indices with a bonus, among the first `boosts_scanned` items
+        self.boosts_scanned = 0
+        self.extend(items, keys)
+
+    def extend(self, items, keys=None):
+        """add items, they get the next indices."""
+        self.items.extend(items)
+        self.normalized.extend(map(normalize, items if keys is None else keys))
+
+    def set_mode(self, mode):
+        if mode not in MODES:
+            raise ValueError(f"unknown match mode: {mode}")
+        self.mode = mode
+        self.last_query = None
+
+    def candidates(self, query):
+        if self.last_query is not None and query.startswith(self.last_query):
+            if self.last_size == len(self.items):
+                return self.last_matches
+            return self.last_matches + list(range(self.last_size, len(self.items)))
+        return range(len(self.items))
+
+    def match(self, query, limit=None, cancelled=None, partial=None, partial_size=50):
+        """return indices of the items matching query, best first, at most limit of them.
+
+        `cancelled()` is checked every CHUNK_SIZE items and raises Cancelled
+        when it returns true. once partial_size matches are found, `partial`
+        is called with the best of them, before the scan is complete."""
+        query = normalize(query)
+        if not query:
+            self.last_query = None
+            if self.frecency:
+                indices = self.match_empty(cancelled)
+            else:
+                # a range is as good as a list to callers and costs nothing for huge inputs
+                indices = range(len(self.items))
+            return indices if limit is None else indices[:limit]
+        candidates = self.candidates(query)
+        size = len(self.items)
+        score = self.match_substring if self.mode == SUBSTRING else self.match_fuzzy
+        scored = []
+        for start in range(0, len(candidates), CHUNK_SIZE):
+            if cancelled and cancelled():
+                raise Cancelled
+            found = len(scored)
+            scored.extend(score(query, candidates[start:start + CHUNK_SIZE]))
+            if partial and found < partial_size <= len(scored):
+                partial(self.rank(scored, partial_size))
+        self.last_query = query
+        self.last_matches = [i for _, i in scored]
+        self.last_size = size
+        return self.rank(scored, limit)
+
+    def boost(self, i):
+        boost = self.boosts.get(i)
+        if boost is None:
+            score = self.frecency.score(self.items[i])
+            boost = self.boosts[i] = round(BONUS_FRECENCY * math.log2(1 + score))
+        return boost
+
+    def match_empty(self, cancelled=None):
+        """every item, the ones with a frecency bonus first."""
+        size = len(self.items)
+        for start in range(self.boosts_scanned, size, CHUNK_SIZE):
+            if cancelled and cancelled():
+                raise Cancelled
+            self.boosted.extend(i for i in range(start, min(start + CHUNK_SIZE, size)) if self.boost(i))
+            self.boosts_scanned = min(start + CHUNK_SIZE, size)
+        if not self.boosted:
+            return range(size)
+        head = sorted(self.boosted, key=lambda i: (-self.boost(i), i))
+        boosted = set(head)
+        return head + [i for i in range(size) if i not in boosted]
+
+    def rank(self, scored, limit=None):
+        # best score first, then shorter items, then original order
+        if self.frecency:
+            key = lambda entry: (-entry[0] - self.boost(entry[1]), len(self.normalized[entry[1]]), entry[1])
+        else:
+            key = lambda entry: (-entry[0], len(self.normalized[entry[1]]), entry[1])
+        if limit is None:
+            ranked = sorted(scored, key=key)
+        else:
+            ranked = heapq.nsmallest(limit, scored, key=key)
+        return [i for _, i in ranked]
+
+    def match_substring(self, query, candidates):
+        normalized = self.normalized
+        scored = []
+        for i in candidates:
+            text = normalized[i]
+            pos = text.find(query)
+            if pos != -1:
+                scored.append((score_substring(text, query, pos), i))
+        return scored
+
+    def match_fuzzy(self, query, candidates):
+        normalized = self.normalized
+        # the regex throws out non-matching items in C, only matches are scored in python
+        match = re.compile(fuzzy_pattern(query)).match
+        scored = []
+        for i in candidates:
+            text = normalized[i]
+            if match(text):
+                scored.append((score_positions(text, fuzzy_positions(text, query)), i))
+        return scored
+
+class SearchWorker:
+    """runs a matcher's searches on a background thread.
+
+    `search` returns right away; a search that is still running when a new
+    one comes in is cancelled. `callback(generation, query, indices, final)`
+    is called from the worker thread, first with a screenful of early results
+    and then with the complete ranking (final=True), and must hand them to the
+    ui thread itself. results with an older generation than the latest search
+    are stale.
+
+    items passed to `add_items` are added to the matcher on the worker thread,
+    after which the latest query is searched again (under a new generation)
+    so its results cover them."""
+
+    def __init__(self, matcher, callback, first_batch=50):
+        self.matcher = matcher
+        self.callback = callback
+        self.first_batch = first_batch
+        self.cond = threading.Condition()
+        self.generation = 0
+        self.pending = None # (generation, query)
+        self.query = None # latest query searched
+        self.new_items = []
+        self.thread = threading.Thread(target=self.run, daemon=True, name="search")
+        self.thread.start()
+
+    def search(self, query):
+        """start searching for query, returns the generation its results will carry."""
+        with self.cond:
+            self.generation += 1
+            self.pending = (self.generation, query)
+            self.cond.notify()
+            return self.generation
+
+    def add_items(self, items):
+        with self.cond:
+            self.new_items.extend(items)
+            self.cond.notify()
+
+    def set_matcher(self, matcher):
+        """search a different matcher from now on, cancelling the current search."""
+        with self.cond:
+            self.generation += 1
+            self.pending = None
+            self.query = None
+            self.new_items = []
+            self.matcher = matcher
+
+    def next_job(self):
+        with self.cond:
+            while self.pending is None and not self.new_items:
+                self.cond.wait()
+            items, self.new_items = self.new_items, []
+            if self.pending is not None:
+                (generation, query), self.pending = self.pending, None
+                self.query = query
+            elif self.query is not None: # search again to cover the new items
+                self.generation += 1
+                generation, query = self.generation, self.query
+            else:
+                generation = query = None
+            return self.matcher, items, generation, query
+
+    def run(self):
+        while True:
+            matcher, items, generation, query = self.next_job()
+            if items:
+                matcher.extend(items)
+            if query is None:
+                continue
+            try:
+                indices = matcher.match(
+                    query,
+                    cancelled=lambda: self.generation != generation,
+                    partial=lambda indices: self.callback(generation, query, indices, False),
+                    partial_size=self.first_batch)
+            except Cancelled:
+                continue
+            self.callback(generation, query, indices, True)
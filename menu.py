@@ -1,14 +1,25 @@
 #!/usr/bin/env python
 import sys
-import select
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, Gdk, Gio
+from gi.repository import Gtk, Gdk, Gio, GLib
 from pathlib import Path
 
+import matcher
+import parallel
+import frecency
+import sources
+import utils
+from menu_args import parse_args
+
+DEFAULT_ITEMS = ["Option 1", "Option 2", "Option 3", "Option 4"]
+
 class DMenuPopup(Gtk.Window):
-    def __init__(self, items=None):
+    def __init__(self, items=None, on_done=None, match_mode=matcher.FUZZY, debounce=30, jobs=1):
         super().__init__()
+        # called with the selected item, or None when dismissed. by default the
+        # item is printed and the window destroyed, like dmenu
+        self.on_done = on_done or self.print_and_destroy
         self.set_title("popup")
         self.set_default_size(400, 500)
         self.set_position(Gtk.WindowPosition.CENTER)
@@ -20,28 +31,68 @@ class DMenuPopup(Gtk.Window):
         self.entry.connect("changed", self.on_entry_changed)
         self.entry.set_placeholder_text("search...")
 
-        # use treeview instead of listbox
+        # matches/total, with a trailing '…' while items are still coming in
+        self.progress = Gtk.Label()
+        self.progress.get_style_context().add_class("dim-label")
+        self.loading = False
+
+        # the results are virtualized: the treeview's store only holds the rows
+        # that fit on screen, `offset` is the index of the first one in `results`
+        # and a separate scrollbar scrolls through all of them
         self.liststore = Gtk.ListStore(str)
         self.treeview = Gtk.TreeView(model=self.liststore)
+        self.offset = 0
+        self.cursor = None # index into results of the selected row
+        self.page_rows = 1
+        self.row_height = None
 
         self.treeview.set_headers_visible(False)
-        self.treeview.connect("row-activated", self.on_item_selected)
+        self.treeview.set_fixed_height_mode(True)
 
         # add a single text column
         renderer = Gtk.CellRendererText()
         column = Gtk.TreeViewColumn("Item", renderer, text=0)
+        column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        column.set_expand(True)
         self.treeview.append_column(column)
-
-        self.scrollable = Gtk.ScrolledWindow()
-        self.scrollable.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
-        self.scrollable.add(self.treeview)
-
-        self.items = items if items else ["Option 1", "Option 2", "Option 3", "Option 4"]
-        self.filtered_items = self.items[:]
-        self.update_items(self.filtered_items)
+        self.column = column
+
+        self.adjustment = Gtk.Adjustment(value=0, lower=0, upper=0, step_increment=1,
+                                         page_increment=1, page_size=1)
+        self.adjustment.connect("value-changed", self.on_scrolled)
+        self.scrollbar = Gtk.Scrollbar(orientation=Gtk.Orientation.VERTICAL, adjustment=self.adjustment)
+        self.treeview.connect("size-allocate", self.on_size_allocate)
+        self.treeview.add_events(Gdk.EventMask.SCROLL_MASK | Gdk.EventMask.SMOOTH_SCROLL_MASK)
+        self.treeview.connect("scroll-event", self.on_scroll_event)
+
+        self.scrollable = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        self.scrollable.pack_start(self.treeview, True, True, 0)
+        self.scrollable.pack_start(self.scrollbar, False, False, 0)
+
+        self.items = items if items is not None else DEFAULT_ITEMS[:]
+        self.outputs = None # printed instead of the items when picked, see show_source
+        # selections are remembered, so frequently picked items rank first
+        self.history = frecency.default()
+        self.jobs = jobs # matching processes, see parallel.py. 1 matches on a thread of this one
+        self.matcher = self.new_matcher(self.items, match_mode)
+        # matching runs on a worker thread, started `debounce` ms after the last keystroke
+        self.debounce = debounce
+        self.search_timeout = None
+        self.search_generation = 0 # generation of the latest search started
+        self.search_pending = False # the rows don't reflect the entry's text yet
+        self.shown_query = None
+        self.accept_when_done = False # return was pressed before the results were in
+        self.worker = matcher.SearchWorker(self.matcher, self.on_worker_results)
+        self.results = range(len(self.items)) # indices into items, best first
+        self.set_results(self.results)
+        self.start_search() # so items added later are searched too
+
+        entry_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        entry_box.pack_start(self.entry, True, True, 0)
+        entry_box.pack_start(self.progress, False, False, 0)
 
         box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
-        box.pack_start(self.entry, False, False, 0)
+        box.pack_start(entry_box, False, False, 0)
         box.pack_start(self.scrollable, True, True, 0)
         self.add(box)
 
@@ -74,29 +125,133 @@ class DMenuPopup(Gtk.Window):
             if path_tuple: # check if a row was clicked
                 path = path_tuple[0] # extract the TreePath
                 if path: # check if path is valid
-                    treeiter = treeview.get_model().get_iter(path)
-                    if treeiter: # check if treeiter is valid
-                        selection = self.treeview.get_selection()
-                        self.treeview.set_cursor(path, None, False)
-                        selection.select_iter(treeiter)
-                        self.on_item_selected(treeview, path, None)
-                        return True # event handled
+                    self.set_row_cursor(self.offset + path.get_indices()[0])
+                    self.on_item_selected(treeview, path, None)
+                    return True # event handled
             return False # let TreeView handle if no row clicked
 
-    def update_items(self, items):
-        """update the treeview with the filtered items."""
-        self.liststore.clear()
-        for item in items:
-            self.liststore.append([item])
+    def set_results(self, results, keep_position=False):
+        """show new results, a sequence of indices into items. only the visible rows are touched.
 
-    def on_entry_changed(self, entry):
-        """filter items based on the search text."""
-        search_text = entry.get_text().lower()
-        if search_text:
-            self.filtered_items = [item for item in self.items if search_text in item.lower()]
+        with keep_position the scroll position and selected row are kept, for
+        when the results only grew because more items came in."""
+        self.results = results
+        if keep_position:
+            self.offset = min(self.offset, max(0, len(results) - self.page_rows))
+            if self.cursor is not None and self.cursor >= len(results):
+                self.cursor = None
         else:
-            self.filtered_items = self.items[:]
-        self.update_items(self.filtered_items)
+            self.offset = 0
+            self.cursor = None
+        self.adjustment.configure(self.offset, 0, len(results), 1, self.page_rows, self.page_rows)
+        self.refresh_page()
+        self.update_progress()
+
+    def add_items(self, items):
+        """append items, e.g. while they are still being read. they are matched in the background."""
+        self.items.extend(items)
+        self.worker.add_items(items)
+        self.update_progress()
+
+    def read_items(self, fd):
+        """stream items from fd (one per line) while the window is already up."""
+        self.loading = True
+        self.update_progress()
+        return utils.LineReader(fd, self.add_items, self.finish_items)
+
+    def finish_items(self):
+        self.loading = False
+        if not self.items: # nothing came in, like dmenu fall back to the defaults
+            self.add_items(DEFAULT_ITEMS)
+        self.update_progress()
+
+    def update_progress(self):
+        self.progress.set_text(f"{len(self.results)}/{len(self.items)}" + ("…" if self.loading else ""))
+
+    def item_at(self, position):
+        return self.items[self.results[position]]
+
+    def refresh_page(self):
+        """fill the treeview's store with the rows between offset and offset + page_rows."""
+        count = max(0, min(self.page_rows, len(self.results) - self.offset))
+        while len(self.liststore) > count:
+            self.liststore.remove(self.liststore.iter_nth_child(None, len(self.liststore) - 1))
+        for row in range(count):
+            text = self.item_at(self.offset + row)
+            if row < len(self.liststore):
+                if self.liststore[row][0] != text:
+                    self.liststore[row][0] = text
+            else:
+                self.liststore.append([text])
+        selection = self.treeview.get_selection()
+        if self.cursor is not None and self.offset <= self.cursor < self.offset + count:
+            self.treeview.set_cursor(Gtk.TreePath(self.cursor - self.offset), None, False)
+        else:
+            selection.unselect_all()
+
+    def on_size_allocate(self, widget, allocation):
+        if self.row_height is None and len(self.liststore) and widget.get_realized():
+            self.row_height = widget.get_background_area(Gtk.TreePath(0), self.column).height or None
+        row_height = self.row_height or 30
+        page_rows = max(1, allocation.height // row_height)
+        if page_rows != self.page_rows:
+            self.page_rows = page_rows
+            # changing the store during size-allocate would re-enter it
+            GLib.idle_add(self.on_page_resized)
+
+    def on_page_resized(self):
+        self.adjustment.set_page_size(self.page_rows)
+        self.adjustment.set_page_increment(self.page_rows)
+        self.refresh_page()
+        return False
+
+    def on_scrolled(self, adjustment):
+        offset = int(adjustment.get_value())
+        if offset != self.offset:
+            self.offset = offset
+            self.refresh_page()
+
+    def on_scroll_event(self, widget, event):
+        if event.direction == Gdk.ScrollDirection.SMOOTH:
+            delta = event.get_scroll_deltas()[2]
+        else:
+            delta = {Gdk.ScrollDirection.UP: -1, Gdk.ScrollDirection.DOWN: 1}.get(event.direction, 0)
+        self.adjustment.set_value(self.adjustment.get_value() + delta * 3)
+        return True
+
+    def on_entry_changed(self, entry):
+        """filter items based on the search text, in the background."""
+        if self.search_timeout:
+            GLib.source_remove(self.search_timeout)
+        self.search_timeout = GLib.timeout_add(self.debounce, self.start_search)
+        self.search_pending = True
+
+    def start_search(self):
+        self.search_timeout = None
+        self.search_generation = self.worker.search(self.entry.get_text())
+        return False
+
+    def on_worker_results(self, generation, query, indices, final):
+        # called on the worker thread
+        GLib.idle_add(self.show_results, generation, query, indices, final)
+
+    def show_results(self, generation, query, indices, final):
+        # superseded by a newer search, or by typing that hasn't been searched yet
+        if generation < self.search_generation or self.search_timeout is not None:
+            return False
+        # the same query again means more items came in, don't move the user's selection
+        self.set_results(indices, keep_position=query == self.shown_query)
+        self.shown_query = query
+        if final:
+            self.search_pending = False
+            if self.accept_when_done:
+                self.accept_when_done = False
+                self.accept(0 if self.results else None)
+        return False
+
+    @property
+    def searching(self):
+        return self.search_pending
 
     def on_hover(self, widget, event):
         """Handle hover event over treeview rows."""
@@ -104,43 +259,89 @@ class DMenuPopup(Gtk.Window):
 
         if path_tuple: # check if hovering over a row
             path = path_tuple[0]
-            self.treeview.set_cursor(path, None, False)
+            self.set_row_cursor(self.offset + path.get_indices()[0])
         return False # let other handlers process the event
 
     def on_item_selected(self, treeview, path, column):
         """handle the item selection."""
-        model = treeview.get_model()
-        item = model[path][0]
-        print(item)
+        self.accept(self.offset + path.get_indices()[0])
+
+    def accept(self, position):
+        """report the item at position in results, or "" for None (nothing matched)."""
+        if position is None:
+            self.on_done("")
+            return
+        index = self.results[position]
+        if self.items[index]:
+            self.history.record(self.items[index])
+        self.on_done(self.items[index] if self.outputs is None else self.outputs[index])
+
+    def print_and_destroy(self, item):
+        if item is not None:
+            print(item)
         self.destroy()
 
+    def new_matcher(self, items, match_mode, keys=None):
+        if self.jobs == 1:
+            return matcher.Matcher(items, match_mode, self.history, keys)
+        return parallel.ParallelMatcher(items, match_mode, self.history, keys, self.jobs)
+
+    def show_items(self, items, match_mode=None, debounce=None, keys=None, outputs=None, jobs=None):
+        """reuse the window for a new set of items, e.g. when kept around by the daemon.
+
+        `keys` is matched instead of the items and `outputs` is reported instead
+        of them when picked, if given."""
+        self.items = items
+        self.outputs = outputs
+        if debounce is not None:
+            self.debounce = debounce
+        if jobs is not None:
+            self.jobs = jobs
+        self.history.refresh() # e.g. picks made with menu.py while we were running
+        self.matcher = self.new_matcher(items, match_mode or self.matcher.mode, keys)
+        self.worker.set_matcher(self.matcher)
+        self.shown_query = None
+        self.accept_when_done = False
+        self.entry.set_text("") # refilters
+        self.on_entry_changed(self.entry)
+        self.show_all()
+        self.present()
+        self.entry.grab_focus()
+        self.next_row()
+
+    def show_source(self, source, match_mode=None, debounce=None, jobs=None):
+        """show the entries of a sources.CachedSource, matching their keywords too."""
+        entries = source.entries()
+        self.show_items([e.label for e in entries], match_mode, debounce,
+                        keys=[f"{e.label} {e.keywords}" for e in entries],
+                        outputs=[e.output for e in entries], jobs=jobs)
+
+    def set_row_cursor(self, position):
+        """select the row at position in results (highlight it)."""
+        self.cursor = position
+        self.treeview.set_cursor(Gtk.TreePath(position - self.offset), None, False)
+
     def next_row(self):
-        selection = self.treeview.get_selection()
-        model, treeiter = selection.get_selected()
-        if treeiter:
-            treeiter = model.iter_next(treeiter)
-        else: # no selection, jump to first item
-            treeiter = model.get_iter_first()
-        if treeiter:
-            self.treeview.set_cursor(model.get_path(treeiter), None, False) # highlight row
-            self.scroll_to_row(treeiter)
+        if self.cursor is None: # no selection, jump to first item
+            position = 0
+        else:
+            position = self.cursor + 1
+        if position < len(self.results):
+            self.scroll_to_row(position)
+            self.set_row_cursor(position) # highlight row
 
     def prev_row(self):
-        selection = self.treeview.get_selection()
-        model, treeiter = selection.get_selected()
-        if treeiter:
-            treeiter = model.iter_previous(treeiter)
-        else: # no selection, jump to last item
-            treeiter = model.get_iter_last()
-        if treeiter:
-            self.treeview.set_cursor(model.get_path(treeiter), None, False)
-            self.scroll_to_row(treeiter)
+        if self.cursor is None: # no selection, jump to last item
+            position = len(self.results) - 1
+        else:
+            position = self.cursor - 1
+        if position >= 0:
+            self.scroll_to_row(position)
+            self.set_row_cursor(position)
 
     def on_key_press(self, widget, event):
         """handle key press events."""
 
-        selection = self.treeview.get_selection()
-        model, treeiter = selection.get_selected()
         if event.state & Gdk.ModifierType.CONTROL_MASK:
             if event.keyval == Gdk.KEY_n: # C-n
                 self.next_row()
@@ -149,36 +350,27 @@ class DMenuPopup(Gtk.Window):
             return True # prevent default behavior of C-n/C-p
 
         if event.keyval == Gdk.KEY_Escape:
-            self.destroy()
-        if event.keyval == Gdk.KEY_Return:
-            selection = self.treeview.get_selection()
-            model, treeiter = selection.get_selected()
-            if treeiter:
-                print(model[treeiter][0])
-            elif self.filtered_items:
-                print(self.filtered_items[0])
+            self.on_done(None)
+        elif event.keyval == Gdk.KEY_Return:
+            if self.searching: # the rows are stale, pick the first result once it's in
+                self.accept_when_done = True
+                return True
+            if self.cursor is not None:
+                self.accept(self.cursor)
+            elif self.results:
+                self.accept(0)
             else:
-                print("")
-            self.destroy()
-
-    def scroll_to_row(self, treeiter):
-        """scroll the TreeView to make the selected row visible."""
-        if treeiter:
-            path = self.treeview.get_model().get_path(treeiter)
-            self.treeview.scroll_to_cell(path, None, True, 0.0, 0.0)
-
-def read_stdin():
-    """read items from stdin, one per line. returns an empty list if no input is available."""
-    items = []
-    if sys.stdin in select.select([sys.stdin], [], [], 0)[0]:
-        for line in sys.stdin:
-            items.append(line.strip())
-    return items
+                self.accept(None)
+
+    def scroll_to_row(self, position):
+        """scroll so the row at position in results is visible."""
+        if position < self.offset:
+            self.adjustment.set_value(position)
+        elif position >= self.offset + self.page_rows:
+            self.adjustment.set_value(position - self.page_rows + 1)
 
 if __name__ == "__main__":
-    items = read_stdin()
-    if not items:
-        items = ["Option 1", "Option 2", "Option 3", "Option 4"]
+    args = parse_args()
 
     # load main.css
     p = Path(__file__).with_name('main.css')
@@ -190,8 +382,15 @@ if __name__ == "__main__":
         Gdk.Screen.get_default(), css_provider, Gtk.STYLE_PROVIDER_PRIORITY_USER
     )
 
-    win = DMenuPopup(items)
+    win = DMenuPopup([], match_mode=args.match, debounce=args.debounce, jobs=args.jobs)
     win.connect("destroy", Gtk.main_quit)
     win.show_all()
+    # items are read while the window is up, a terminal on stdin means there are none
+    if args.source:
+        win.show_source(sources.get(args.source))
+    elif sys.stdin.isatty():
+        win.finish_items()
+    else:
+        win.read_items(sys.stdin.fileno())
 
     Gtk.main()
\ No newline at end of file
@@ -0,0 +1,21 @@
+"""menu.py's command line, shared with client.py.
+
+only the standard library is imported here, so the client can check its
+arguments (and print --help) without loading gtk."""
+import argparse
+
+import matcher
+import sources
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="pick one of the lines on stdin")
+    parser.add_argument('--match', choices=matcher.MODES, default=matcher.FUZZY,
+                        help="how the query is matched against the items (default: fuzzy)")
+    parser.add_argument('--debounce', type=int, default=30, metavar='MS',
+                        help="wait this long after a keystroke before searching (default: 30)")
+    parser.add_argument('--source', choices=sources.SOURCES,
+                        help="list executables on $PATH or installed applications instead of reading stdin")
+    parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                        help="match on N processes, 0 for one per core. "
+                             "for millions of items, only the best 1000 are listed (default: 1)")
+    return parser.parse_args(argv)
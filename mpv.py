@@ -0,0 +1,129 @@
+import os
+import json
+import socket
+
+from gi.repository import GLib, Gio
+
+import scheduler
+
+# mpv has to be started with --input-ipc-server pointing here, e.g. in mpv.conf:
+# input-ipc-server=/tmp/mpvsocket
+DEFAULT_SOCKET = os.getenv("MPV_IPC_SOCKET", "/tmp/mpvsocket")
+
+# ids for observe_property, mpv echoes them back in property-change events
+OBSERVED = {1: 'media-title', 2: 'metadata'}
+
+def format_track(title, metadata):
+    """build the track text from mpv's media-title and metadata properties."""
+    metadata = {k.lower(): v for k, v in (metadata or {}).items()}
+    artist = metadata.get('artist')
+    track_title = metadata.get('title') or title
+    if artist and track_title:
+        return f"{artist} - {track_title}"
+    return track_title or ''
+
+class MpvSource:
+    """pushes the currently playing track to `callback(text)` whenever it changes.
+
+    connects to mpv's json ipc socket and observes the title and metadata, so
+    nothing runs while the track stays the same. when there is no socket (mpv
+    not running), `fallback_command` is polled every `poll_interval` seconds
+    instead, and each poll also retries the socket."""
+
+    def __init__(self, callback, path=DEFAULT_SOCKET,
+                 fallback_command=('current_mpv_track_more.sh',), poll_interval=5):
+        self.callback = callback
+        self.path = path
+        self.fallback_command = list(fallback_command) if fallback_command else None
+        self.poll_interval = poll_interval
+        self.sock = None
+        self.buffer = b''
+        self.properties = {}
+        self.text = None
+        self.poll_source = None
+
+    def start(self):
+        if not self.connect():
+            self.start_polling()
+
+    def connect(self):
+        if not os.path.exists(self.path):
+            return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError: # stale socket left behind by a dead mpv
+            sock.close()
+            return False
+        sock.setblocking(False)
+        self.sock = sock
+        self.buffer = b''
+        self.properties = {}
+        commands = b''.join(
+            json.dumps({'command': ['observe_property', id, name]}).encode() + b'\n'
+            for id, name in OBSERVED.items()
+        )
+        sock.sendall(commands)
+        GLib.io_add_watch(sock.fileno(), GLib.PRIORITY_DEFAULT,
+                          GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self.on_readable)
+        return True
+
+    def on_readable(self, fd, condition):
+        try:
+            data = self.sock.recv(65536) if condition & GLib.IO_IN else b''
+        except BlockingIOError:
+            return True
+        except OSError:
+            data = b''
+        if not data: # mpv quit
+            self.sock.close()
+            self.sock = None
+            self.publish('')
+            self.start_polling()
+            return False
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b'\n')
+        for line in lines:
+            self.on_message(line)
+        return True
+
+    def on_message(self, line):
+        try:
+            message = json.loads(line)
+        except ValueError:
+            return
+        if message.get('event') == 'property-change' and message.get('id') in OBSERVED:
+            self.properties[message['name']] = message.get('data')
+            self.publish(format_track(self.properties.get('media-title'),
+                                      self.properties.get('metadata')))
+
+    def publish(self, text):
+        if text != self.text:
+            self.text = text
+            self.callback(text)
+
+    def start_polling(self):
+        if self.poll_source is None:
+            # polling spawns a process, so it's an expensive source for the scheduler
+            self.poll_source = scheduler.default().add(self.poll, self.poll_interval, cost=5)
+            self.poll()
+
+    def poll(self):
+        if self.connect():
+            scheduler.default().remove(self.poll_source)
+            self.poll_source = None # the socket takes over
+            return
+        if self.fallback_command:
+            try:
+                process = Gio.Subprocess.new(self.fallback_command, Gio.SubprocessFlags.STDOUT_PIPE)
+            except GLib.Error:
+                return
+            process.communicate_utf8_async(None, None, self.on_poll_finished)
+
+    def on_poll_finished(self, process, result):
+        try:
+            _, stdout, _ = process.communicate_utf8_finish(result)
+        except GLib.Error:
+            return
+        if self.sock is None:
+            self.publish((stdout or '').strip())
@@ -0,0 +1,269 @@
+"""matching on several processes, for inputs too large for one python thread.
+
+the normalized items are packed into one buffer ('\\n' after each) with an
+array of offsets, both in memfds that every worker maps, so nothing is
+copied per worker or per query. a query is split into shards of SHARD_SIZE
+items that are handed out one at a time to whichever worker is idle; each
+returns its best TOP matches and those are merged.
+
+the workers are started as plain scripts (this file), not with
+multiprocessing, which would import the main module (e.g. the daemon) in
+every one of them."""
+import os
+import re
+import sys
+import mmap
+import array
+import bisect
+import heapq
+import socket
+import weakref
+import itertools
+import subprocess
+from multiprocessing.connection import Connection, wait
+
+import matcher
+
+SHARD_SIZE = 1 << 16
+TOP = 1000 # results kept per query
+ATTEMPTS = 2 # workers a shard may take down before it's searched on this process instead
+
+def skip_to(char):
+    """a bytes pattern for the rest of the line up to and including the first char.
+
+    like matcher.fuzzy_pattern's gaps it never backtracks. a char of several
+    bytes can only be skipped a byte at a time, refusing its lead byte where
+    the rest follows."""
+    encoded = char.encode()
+    lead, rest = re.escape(encoded[:1]), re.escape(encoded[1:])
+    if not rest:
+        return b'[^%s\n]*%s' % (lead, lead)
+    return b'(?:[^%s\n]|%s(?!%s))*%s%s' % (lead, lead, rest, lead, rest)
+
+def compile_query(query, mode):
+    """a bytes pattern finding lines that match query, a match never spans a newline.
+    like the items, the query mustn't contain newlines.
+
+    fuzzy matches are anchored at the start of a line, so every line is tried once."""
+    if mode == matcher.SUBSTRING:
+        return re.compile(re.escape(query.encode()))
+    return re.compile(b'(?m)^' + b''.join(map(skip_to, query)))
+
+def search_shard(text, offsets, start, end, query, mode, top):
+    """the best `top` matches among items start..end as (-score, length, index), best first."""
+    search = compile_query(query, mode).search
+    pos, endpos = offsets[start], offsets[end]
+    scored = []
+    while True:
+        match = search(text, pos, endpos)
+        if match is None:
+            break
+        i = bisect.bisect_right(offsets, match.start(), start, end) - 1
+        item = text[offsets[i]:offsets[i + 1] - 1].decode(errors='replace')
+        if mode == matcher.SUBSTRING:
+            score = matcher.score_substring(item, query, item.find(query))
+        else:
+            score = matcher.score_positions(item, matcher.fuzzy_positions(item, query))
+        scored.append((-score, len(item), i))
+        pos = offsets[i + 1] # on to the next item
+    return heapq.nsmallest(top, scored)
+
+class Worker:
+    """the pool's end of a worker process."""
+
+    def __init__(self):
+        parent, child = socket.socketpair()
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), str(child.fileno())],
+                                        pass_fds=[child.fileno()])
+        child.close()
+        self.sock = parent
+        self.conn = Connection(os.dup(parent.fileno()))
+        self.attached = None # key of the matcher whose buffers the worker has
+        self.task = None # (sequence, shard) in flight
+
+    def attach(self, key, fds):
+        self.conn.send(('attach', key))
+        socket.send_fds(self.sock, [b'.'], fds)
+        self.attached = key
+
+    def close(self):
+        self.conn.close()
+        self.sock.close()
+        self.process.wait()
+
+class Pool:
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.workers = []
+        self.sequence = itertools.count(1)
+
+    def start(self):
+        while len(self.workers) < self.jobs:
+            self.workers.append(Worker())
+
+    def restart(self, worker):
+        worker.close()
+        self.workers[self.workers.index(worker)] = Worker()
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+        self.workers = []
+
+_pools = {}
+
+def pool(jobs=0):
+    """return the shared pool with `jobs` workers, one per core for 0."""
+    jobs = jobs or os.cpu_count() or 1
+    if jobs not in _pools:
+        _pools[jobs] = Pool(jobs)
+    return _pools[jobs]
+
+def close_fds(fds):
+    for fd in fds:
+        os.close(fd)
+
+class ParallelMatcher(matcher.Matcher):
+    """a Matcher that scores on a pool of worker processes, see the module docstring.
+
+    only the best TOP (or `limit`) matches are returned, and frecency
+    bonuses are applied when merging, so a picked item only gets ahead if its
+    shard returned it."""
+
+    keys = itertools.count(1)
+
+    def __init__(self, items, mode=matcher.FUZZY, frecency=None, keys=None, jobs=0):
+        self.pool = pool(jobs)
+        self.key = next(ParallelMatcher.keys)
+        self.text_fd = os.memfd_create("menu-items")
+        self.offsets_fd = os.memfd_create("menu-offsets")
+        weakref.finalize(self, close_fds, (self.text_fd, self.offsets_fd))
+        self.text_size = 0
+        self.count = 0
+        os.pwrite(self.offsets_fd, array.array('Q', [0]).tobytes(), 0)
+        super().__init__(items, mode, frecency, keys)
+
+    def extend(self, items, keys=None):
+        """add items, they get the next indices."""
+        self.items.extend(items)
+        encoded = [matcher.normalize(key).replace('\n', ' ').encode() + b'\n'
+                   for key in (items if keys is None else keys)]
+        if not encoded:
+            return
+        ends = array.array('Q', itertools.accumulate(map(len, encoded), initial=self.text_size))[1:]
+        os.pwrite(self.text_fd, b''.join(encoded), self.text_size)
+        os.pwrite(self.offsets_fd, ends.tobytes(), (self.count + 1) * ends.itemsize)
+        self.text_size = ends[-1]
+        self.count += len(encoded)
+
+    def match(self, query, limit=None, cancelled=None, partial=None, partial_size=50):
+        query = matcher.normalize(query).replace('\n', ' ') # as in the items, see extend
+        if not query or not self.count:
+            return super().match(query, limit, cancelled)
+        limit = limit or TOP
+        sequence = next(self.pool.sequence)
+        shards = [(start, min(start + SHARD_SIZE, self.count)) for start in range(0, self.count, SHARD_SIZE)]
+        shards.reverse() # popped from the end
+        scored = []
+        attempts = {} # shard -> workers lost on it
+        partial_sent = False
+        self.pool.start()
+        while True:
+            for worker in self.pool.workers:
+                if worker.task is None and shards:
+                    self.send(worker, sequence, shards.pop(), query, limit)
+            busy = {worker.conn: worker for worker in self.pool.workers if worker.task is not None}
+            if not busy:
+                break
+            for conn in wait(busy):
+                worker = busy[conn]
+                (task_sequence, shard), worker.task = worker.task, None
+                try:
+                    reply = conn.recv()
+                except (EOFError, OSError): # the worker died, give its shard to another one
+                    self.pool.restart(worker)
+                    if task_sequence != sequence:
+                        continue
+                    attempts[shard] = attempts.get(shard, 0) + 1
+                    if attempts[shard] < ATTEMPTS:
+                        shards.append(shard)
+                    else: # it's the shard, not the worker
+                        scored.extend(self.search_here(shard, query, limit))
+                    continue
+                if task_sequence == sequence: # not left over from a cancelled search
+                    scored.extend(reply)
+            if cancelled and cancelled():
+                raise matcher.Cancelled # shards in flight are dropped when they come back
+            if partial and not partial_sent and len(scored) >= partial_size:
+                partial_sent = True
+                partial(self.rank(scored, partial_size))
+        return self.rank(scored, limit)
+
+    def send(self, worker, sequence, shard, query, limit):
+        if worker.attached != self.key:
+            worker.attach(self.key, [self.text_fd, self.offsets_fd])
+        worker.conn.send(('search', query, self.mode, *shard, self.text_size, self.count, limit))
+        worker.task = (sequence, shard)
+
+    def search_here(self, shard, query, limit):
+        """search a shard on this process, as a worker would."""
+        text = mmap.mmap(self.text_fd, self.text_size, prot=mmap.PROT_READ)
+        offsets = mmap.mmap(self.offsets_fd, (self.count + 1) * 8, prot=mmap.PROT_READ)
+        view = memoryview(offsets).cast('Q')
+        try:
+            return search_shard(text, view, *shard, query, self.mode, limit)
+        finally:
+            view.release()
+            offsets.close()
+            text.close()
+
+    def rank(self, scored, limit=None):
+        # scored holds (-score, length, index) from the workers
+        if self.frecency:
+            key = lambda entry: (entry[0] - self.boost(entry[2]), entry[1], entry[2])
+        else:
+            key = None
+        return [entry[2] for entry in heapq.nsmallest(limit or len(scored), scored, key=key)]
+
+class Mapping:
+    """a worker's read-only view of a memfd, remapped when it grew."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.map = None
+        self.size = 0
+
+    def ensure(self, size):
+        if size > self.size:
+            self.map = mmap.mmap(self.fd, size, prot=mmap.PROT_READ)
+            self.size = size
+        return self.map
+
+    def close(self):
+        os.close(self.fd)
+
+def serve(fd):
+    sock = socket.socket(fileno=fd)
+    conn = Connection(os.dup(fd))
+    text = offsets = None
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError: # the menu is gone
+            return
+        if message[0] == 'attach':
+            _, fds, _, _ = socket.recv_fds(sock, 1, 2)
+            for mapping in (text, offsets):
+                if mapping is not None:
+                    mapping.close()
+            text, offsets = Mapping(fds[0]), Mapping(fds[1])
+            continue
+        _, query, mode, start, end, text_size, count, limit = message
+        view = memoryview(offsets.ensure((count + 1) * 8)).cast('Q')
+        try:
+            conn.send(search_shard(text.ensure(text_size), view, start, end, query, mode, limit))
+        finally:
+            view.release()
+
+if __name__ == "__main__":
+    serve(int(sys.argv[1]))
@@ -1,38 +1,284 @@
+import sys
 import subprocess
+import threading
+import time
 import re
 
 import utils
 
+try:
+    import pulsectl
+except ImportError:
+    pulsectl = None
+
 def get_default_sink():
+    if backend:
+        return backend.default_sink
     out = subprocess.check_output(['pactl', 'get-default-sink'])
     return out.strip()
 
 def get_default_sink_volume():
+    if backend:
+        return backend.volume
     out = subprocess.check_output(['pactl',
                                    'get-sink-volume',
                                    get_default_sink()]).decode()
-    return re.findall('([0-9]+)%', out)[0]
+    return int(re.findall('([0-9]+)%', out)[0])
 
 def set_default_sink_volume(volume):
+    if backend:
+        backend.set_volume(volume)
+        return
     subprocess.run(['pactl',
                     'set-sink-volume',
                     get_default_sink(),
                     f'{volume}%'])
 
-listeners = []
-def add_listener(listener):
-    listeners.append(listener)
+class NativeBackend:
+    """one long-lived connection to the sound server through libpulse (pulsectl).
+
+    the connection is owned by a single thread that waits for sink/server
+    events on it, keeps the default sink and its volume cached, and applies
+    volume changes queued by `set_volume`. reading the volume is a plain
+    attribute access, nothing is spawned."""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.default_sink = None
+        self.volume = 0
+        self.pending_volume = None
+        self.pulse = None
+        self.lock = threading.Lock()
+        self.events = []
+        self.thread = None
+
+    def start(self):
+        """connect to the sound server, returns False if it can't be reached."""
+        try:
+            pulse = self.connect()
+        except pulsectl.PulseError:
+            return False
+        self.thread = threading.Thread(target=self.run, args=(pulse,), daemon=True, name="pulseaudio")
+        self.thread.start()
+        return True
+
+    def connect(self):
+        pulse = pulsectl.Pulse('widgets')
+        pulse.event_mask_set('sink', 'server')
+        pulse.event_callback_set(self.on_event)
+        self.refresh(pulse)
+        with self.lock:
+            self.pulse = pulse
+        return pulse
+
+    def set_volume(self, volume):
+        with self.lock:
+            self.pending_volume = volume
+            pulse = self.pulse
+        if pulse:
+            pulse.event_listen_stop() # wake the connection thread up
+
+    def run(self, pulse):
+        while True:
+            try:
+                while True:
+                    self.apply_pending(pulse)
+                    # the timeout only covers a wakeup racing the start of the poll
+                    pulse.event_listen(timeout=1.0)
+                    self.process_events(pulse)
+            except pulsectl.PulseError:
+                with self.lock:
+                    self.pulse = None
+                pulse.close()
+            # the server went away, reconnect
+            while True:
+                time.sleep(1)
+                try:
+                    pulse = self.connect()
+                    break
+                except pulsectl.PulseError:
+                    pass
+
+    def on_event(self, event):
+        # libpulse must not be called from within the callback, so stop the loop and handle it there
+        self.events.append(Event(str(event.facility), str(event.t), event.index))
+        raise pulsectl.PulseLoopStop
+
+    def process_events(self, pulse):
+        events, self.events = self.events, []
+        if not events:
+            return
+        self.refresh(pulse)
+        for event in events:
+            self.handler(event)
+
+    def apply_pending(self, pulse):
+        with self.lock:
+            volume, self.pending_volume = self.pending_volume, None
+        if volume is not None and self.default_sink:
+            sink = pulse.get_sink_by_name(self.default_sink)
+            pulse.volume_set_all_chans(sink, volume / 100)
+            self.volume = int(volume)
+
+    def refresh(self, pulse):
+        global default_sink_index
+        self.default_sink = pulse.server_info().default_sink_name
+        sink = pulse.get_sink_by_name(self.default_sink)
+        self.volume = round(sink.volume.value_flat * 100)
+        default_sink_index = sink.index
+
+class VolumeWriter:
+    """writes volume changes in the background, keeping only the latest requested value.
+
+    `set` never blocks: it replaces the pending value and the writer thread
+    sends it at most `max_rate` times per second. `echo_remaining` tells for
+    how long volume changes reported by the server are likely caused by our
+    own writes, so widgets don't get pushed back to stale values while being
+    dragged, and can read the volume again once that's over."""
+
+    def __init__(self, max_rate=20, echo_window=0.5, write=None):
+        self.interval = 1 / max_rate
+        self.echo_window = echo_window
+        self.write = write or set_default_sink_volume
+        self.cond = threading.Condition()
+        self.pending = None
+        self.last_write_time = 0
+        self.thread = None
+
+    def set(self, volume):
+        with self.cond:
+            self.pending = int(volume)
+            self.cond.notify()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True, name="volume-writer")
+                self.thread.start()
+
+    def echo_remaining(self):
+        """seconds until the server's events stop being echoes of our writes, 0 when they aren't."""
+        with self.cond:
+            if self.pending is not None: # not even written yet
+                return self.echo_window
+            return max(0, self.last_write_time + self.echo_window - time.monotonic())
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.pending is None:
+                    self.cond.wait()
+                delay = self.last_write_time + self.interval - time.monotonic()
+                if delay > 0:
+                    # newer values may come in while we wait, only the latest is written
+                    self.cond.wait(delay)
+                    continue
+                volume, self.pending = self.pending, None
+            try:
+                self.write(volume)
+            except Exception as e: # e.g. pactl failed, the next value may well get through
+                print(f"pulseaudio: cannot set the volume to {volume}: {e}", file=sys.stderr)
+            with self.cond:
+                self.last_write_time = time.monotonic()
 
-def handler(line):
-    for listener in listeners:
-        listener(line)
+_volume_writer = None
+
+def volume_writer():
+    """return the shared volume writer."""
+    global _volume_writer
+    if _volume_writer is None:
+        _volume_writer = VolumeWriter()
+    return _volume_writer
+
+class Event:
+    """a parsed subscription event, e.g. "Event 'change' on sink #53" -> Event('sink', 'change', 53)."""
+    __slots__ = ('facility', 'action', 'index')
+
+    def __init__(self, facility, action, index):
+        self.facility = facility
+        self.action = action
+        self.index = index
+
+    def __repr__(self):
+        return f"Event({self.facility!r}, {self.action!r}, {self.index!r})"
+
+EVENT_RE = re.compile(r"Event '([a-z]+)' on ([a-z-]+)(?: #(-?\d+))?")
+
+def parse_event(line):
+    match = EVENT_RE.match(line)
+    if not match:
+        return None
+    action, facility, index = match.groups()
+    return Event(facility, action, int(index) if index else None)
+
+# pass as index to subscribe to whichever sink is currently the default one
+DEFAULT_SINK = 'default'
+
+subscriptions = [] # (facility, index, callback)
+stats = {'received': 0, 'delivered': 0}
+default_sink_index = None
+
+def subscribe(callback, facility, index=None):
+    """call callback(event) (from the listener thread) for events of `facility`.
+
+    if index is given only events for that object are delivered, index can be
+    DEFAULT_SINK to follow the default sink."""
+    subscriptions.append((facility, index, callback))
+
+def dispatch(event):
+    stats['received'] += 1
+    if event.facility == 'server' and not backend:
+        # the default sink may have changed, pactl is too slow to wait for on the main loop
+        threading.Thread(target=update_default_sink_index, daemon=True, name="pulseaudio-default-sink").start()
+    delivered = False
+    for facility, index, callback in subscriptions:
+        if facility != event.facility:
+            continue
+        if index == DEFAULT_SINK:
+            index = default_sink_index
+        if index is None or index == event.index:
+            callback(event)
+            delivered = True
+    if delivered:
+        stats['delivered'] += 1
+
+def handle_line(line):
+    event = parse_event(line)
+    if event:
+        dispatch(event)
+
+default_sink_lock = threading.Lock() # one lookup at a time, so the latest one wins
+
+def update_default_sink_index():
+    with default_sink_lock:
+        _update_default_sink_index()
+
+def _update_default_sink_index():
+    global default_sink_index
+    try:
+        default_sink = get_default_sink().decode()
+        out = subprocess.check_output(['pactl', 'list', 'short', 'sinks']).decode()
+    except (OSError, subprocess.CalledProcessError):
+        # unknown, events of all sinks will be delivered
+        default_sink_index = None
+        return
+    for line in out.splitlines():
+        index, name = line.split('\t')[:2]
+        if name == default_sink:
+            default_sink_index = int(index)
+            return
+    default_sink_index = None
+
+backend = None
 
 def start_listener():
-    cmd = [
-        'sh',
-        '-c',
-        'pactl subscribe | grep --line-buffered "sink"'
-    ]
-    utils.handle_subprocess_subscription(cmd, handler)
-
-start_listener()
\ No newline at end of file
+    global backend
+    if pulsectl is not None:
+        native = NativeBackend(dispatch)
+        if native.start():
+            backend = native
+            return
+    # fall back to pactl. it reports every client, card and source too, grep keeps
+    # those from waking up the main loop
+    update_default_sink_index()
+    utils.handle_subprocess_subscription(
+        ['sh', '-c', 'pactl subscribe | grep --line-buffered -E "on (sink|server) "'], handle_line)
+
+start_listener()
@@ -0,0 +1,130 @@
+import math
+import time
+import traceback
+
+from gi.repository import GLib, Gio
+
+class Source:
+    """a periodic callback. `interval` is in seconds and may be changed at any time,
+    `cost` is a rough relative cost of one run (1 = cheap, e.g. reading a file)."""
+    __slots__ = ('callback', 'interval', 'cost', 'due')
+
+    def __init__(self, callback, interval, cost=1):
+        self.callback = callback
+        self.interval = interval
+        self.cost = cost
+        self.due = 0
+
+class Scheduler:
+    """runs periodic sources on shared wakeups aligned to wall-clock boundaries.
+
+    a source with an interval of n seconds runs when the wall clock crosses a
+    multiple of n, so all sources due at the same second share one wakeup and
+    nothing drifts. while throttled (e.g. the bar is unmapped or the session
+    is idle) each interval is stretched by `throttle_factor * cost`, and when
+    the throttle is lifted every source runs once right away."""
+
+    def __init__(self, throttle_factor=10):
+        self.throttle_factor = throttle_factor
+        self.sources = []
+        self.throttle_reasons = set()
+        self.timeout_source = None
+        self.wakeups = 0
+
+    @property
+    def throttled(self):
+        return bool(self.throttle_reasons)
+
+    def add(self, callback, interval, cost=1):
+        source = Source(callback, interval, cost)
+        source.due = self.next_boundary(source, time.time())
+        self.sources.append(source)
+        self.reschedule()
+        return source
+
+    def remove(self, source):
+        if source in self.sources:
+            self.sources.remove(source)
+            self.reschedule()
+
+    def set_throttled(self, reason, throttled):
+        """throttle (or stop throttling) for `reason`, e.g. 'unmapped' or 'idle'."""
+        was_throttled = self.throttled
+        if throttled:
+            self.throttle_reasons.add(reason)
+        else:
+            self.throttle_reasons.discard(reason)
+        if was_throttled == self.throttled:
+            return
+        now = time.time()
+        if not self.throttled: # catch up on whatever went stale in the meantime
+            for source in list(self.sources):
+                self.run(source)
+        for source in self.sources:
+            source.due = self.next_boundary(source, now)
+        self.reschedule()
+
+    def effective_interval(self, source):
+        if self.throttled:
+            return source.interval * self.throttle_factor * source.cost
+        return source.interval
+
+    def next_boundary(self, source, now):
+        interval = self.effective_interval(source)
+        return (math.floor(now / interval) + 1) * interval
+
+    def reschedule(self):
+        if self.timeout_source is not None:
+            GLib.source_remove(self.timeout_source)
+            self.timeout_source = None
+        if not self.sources:
+            return
+        due = min(source.due for source in self.sources)
+        delay = max(0, math.ceil((due - time.time()) * 1000))
+        self.timeout_source = GLib.timeout_add(delay, self.on_wakeup)
+
+    def run(self, source):
+        # a failing source mustn't take the others (and the next wakeup) down with it
+        try:
+            source.callback()
+        except Exception:
+            traceback.print_exc()
+
+    def on_wakeup(self):
+        self.timeout_source = None
+        self.wakeups += 1
+        now = time.time()
+        # cheap sources first, so they aren't delayed by expensive ones sharing the wakeup
+        due = sorted((s for s in self.sources if s.due <= now), key=lambda s: s.cost)
+        for source in due:
+            self.run(source)
+            # the callback may have removed the source or changed its interval
+            source.due = self.next_boundary(source, max(now, source.due))
+        self.reschedule()
+        return False # one-shot, reschedule() adds the next one
+
+_default = None
+
+def default():
+    """return the shared scheduler."""
+    global _default
+    if _default is None:
+        _default = Scheduler()
+    return _default
+
+def watch_session_idle(callback):
+    """call callback(idle) when logind's IdleHint for this session changes, if logind is available."""
+    try:
+        proxy = Gio.DBusProxy.new_for_bus_sync(
+            Gio.BusType.SYSTEM, Gio.DBusProxyFlags.NONE, None,
+            'org.freedesktop.login1', '/org/freedesktop/login1/session/auto',
+            'org.freedesktop.login1.Session', None)
+    except GLib.Error:
+        return None
+
+    def on_properties_changed(proxy, changed, invalidated):
+        changed = changed.unpack()
+        if 'IdleHint' in changed:
+            callback(changed['IdleHint'])
+    proxy.connect('g-properties-changed', on_properties_changed)
+    return proxy
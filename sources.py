@@ -0,0 +1,205 @@
+import os
+import re
+import json
+from typing import NamedTuple
+
+CACHE_VERSION = 1
+
+def cache_dir():
+    cache = os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache, "widgets", "sources")
+
+class Entry(NamedTuple):
+    label: str # shown in the menu
+    keywords: str # matched along with the label
+    output: str # printed when picked
+
+def mtime(directory):
+    try:
+        return os.stat(directory).st_mtime_ns
+    except OSError:
+        return None
+
+class CachedSource:
+    """menu entries gathered from a list of directories, cached on disk per directory.
+
+    a directory is only read again when its mtime changed (a file was added,
+    removed or renamed into it), so when nothing changed `entries` costs a
+    stat per directory and reading the cache. subclasses provide
+    `directories()` and `scan(directory)`; subdirectories that scan reports
+    are visited after their parent, and cached like it."""
+
+    name = None
+
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path or os.path.join(cache_dir(), self.name + ".json")
+        self.scanned = 0 # directories read in the last `entries` call
+
+    def directories(self):
+        raise NotImplementedError
+
+    def scan(self, directory):
+        """return ([(key, entry or None), ...], subdirectories) for a directory. a key
+        seen in an earlier directory shadows the later ones, an entry of None hides it."""
+        raise NotImplementedError
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if cache.get('version') != CACHE_VERSION:
+            return {}
+        return cache['directories']
+
+    def save_cache(self, directories):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp = self.cache_path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'directories': directories}, f)
+        os.replace(tmp, self.cache_path)
+
+    def entries(self):
+        cached = self.load_cache()
+        directories = {} # directory -> [mtime, found, subdirectories], in order of precedence
+        self.scanned = 0
+
+        def visit(directory):
+            if directory in directories:
+                return
+            stamp = mtime(directory)
+            if directory in cached and cached[directory][0] == stamp:
+                directories[directory] = cached[directory]
+            else:
+                self.scanned += 1
+                try:
+                    found, subdirectories = self.scan(directory) if stamp is not None else ([], [])
+                except OSError:
+                    found, subdirectories = [], []
+                directories[directory] = [stamp, found, subdirectories]
+            for subdirectory in directories[directory][2]:
+                visit(subdirectory)
+
+        for directory in self.directories():
+            visit(directory)
+        if self.scanned or directories.keys() != cached.keys():
+            try:
+                self.save_cache(directories)
+            except OSError: # e.g. a read-only home, we'll just scan again next time
+                pass
+        seen = set()
+        entries = []
+        for _, found, _ in directories.values():
+            for key, entry in found:
+                if key in seen:
+                    continue
+                seen.add(key)
+                if entry is not None:
+                    entries.append(Entry(*entry))
+        return entries
+
+class PathSource(CachedSource):
+    """the executables on $PATH, like dmenu_path."""
+
+    name = "path"
+
+    def directories(self):
+        return [d for d in os.getenv("PATH", "").split(os.pathsep) if d]
+
+    def scan(self, directory):
+        found = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_file() and os.access(entry.path, os.X_OK):
+                        found.append((entry.name, (entry.name, "", entry.name)))
+                except OSError:
+                    continue
+        found.sort()
+        return found, []
+
+FIELD_CODE = re.compile(r'%[fFuUdDnNickvm]')
+
+def parse_desktop_file(path):
+    """the [Desktop Entry] group of a .desktop file as a dict, without localized keys."""
+    fields = {}
+    group = None
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('['):
+                if group == 'Desktop Entry': # the only group we read, and it comes first
+                    break
+                group = line[1:-1]
+                continue
+            if group == 'Desktop Entry':
+                key, sep, value = line.partition('=')
+                if sep and '[' not in key:
+                    fields[key.strip()] = value.strip()
+    return fields
+
+def desktop_entry(fields):
+    """an Entry for an application, or None if it shouldn't be listed."""
+    if fields.get('Type') != 'Application' or 'Name' not in fields or 'Exec' not in fields:
+        return None
+    if fields.get('NoDisplay') == 'true' or fields.get('Hidden') == 'true':
+        return None
+    command = FIELD_CODE.sub('', fields['Exec']).replace('%%', '%')
+    command = ' '.join(command.split())
+    keywords = ' '.join(filter(None, (
+        fields.get('GenericName', ''),
+        *fields.get('Keywords', '').split(';'),
+        os.path.basename(command.split(' ', 1)[0]),
+    )))
+    return (fields['Name'], keywords, command)
+
+class DesktopSource(CachedSource):
+    """applications from the XDG application directories, printing their command when picked."""
+
+    name = "apps"
+
+    def directories(self):
+        data_home = os.getenv("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+        data_dirs = os.getenv("XDG_DATA_DIRS") or "/usr/local/share:/usr/share"
+        roots = [data_home, *(d for d in data_dirs.split(':') if d)]
+        return [os.path.join(root, "applications") for root in roots]
+
+    def scan(self, directory):
+        prefix = self.id_prefix(directory)
+        found = []
+        subdirectories = []
+        with os.scandir(directory) as it:
+            for file in it:
+                if file.is_dir():
+                    # part of the desktop file id, kde4/foo.desktop is kde4-foo.desktop
+                    subdirectories.append(file.path)
+                    continue
+                if not file.name.endswith('.desktop'):
+                    continue
+                try:
+                    entry = desktop_entry(parse_desktop_file(file.path))
+                except OSError:
+                    continue
+                found.append((prefix + file.name, entry))
+        found.sort()
+        subdirectories.sort()
+        return found, subdirectories
+
+    def id_prefix(self, directory):
+        parent, name = os.path.split(directory)
+        if name == "applications":
+            return ""
+        return self.id_prefix(parent) + name + "-"
+
+SOURCES = {source.name: source for source in (PathSource, DesktopSource)}
+
+_sources = {}
+
+def get(name):
+    """return the shared source called name, see SOURCES."""
+    if name not in _sources:
+        _sources[name] = SOURCES[name]()
+    return _sources[name]
@@ -0,0 +1,86 @@
+import threading
+
+from gi.repository import GLib
+
+class Store:
+    """central state shared between data sources and widgets.
+
+    sources `publish` values under keys such as 'volume' or 'date'. a value
+    equal to the current one is dropped right away, other changes are
+    collected and the widgets bound to the changed keys are notified once per
+    frame. published values must not be mutated afterwards, publish a new
+    object (e.g. a tuple) instead.
+
+    if `widget` is given, notifications run from its frame clock, so nothing is
+    pushed to widgets while it isn't drawn; otherwise a short timeout is used."""
+
+    FRAME = 1 / 60
+
+    def __init__(self, widget=None):
+        self.widget = widget
+        self.values = {}
+        self.bindings = [] # (keys, callback)
+        self.changed = set()
+        self.lock = threading.Lock()
+        self.scheduled = False
+        # counters
+        self.published = 0
+        self.suppressed = 0 # publishes that didn't change the value
+        self.coalesced = 0 # changes replaced by a newer one before reaching widgets
+        self.notified = 0 # callbacks run
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def bind(self, keys, callback):
+        """call callback(*values) when any of keys changes, a single key may be given as a string.
+
+        the callback is run once right away if all keys already have a value."""
+        if isinstance(keys, str):
+            keys = (keys,)
+        keys = tuple(keys)
+        self.bindings.append((keys, callback))
+        if all(key in self.values for key in keys):
+            callback(*(self.values[key] for key in keys))
+
+    def publish(self, key, value):
+        """set key to value, can be called from any thread."""
+        with self.lock:
+            self.published += 1
+            if key in self.values and self.values[key] == value:
+                self.suppressed += 1
+                return
+            self.values[key] = value
+            if key in self.changed:
+                self.coalesced += 1
+            self.changed.add(key)
+            if not self.scheduled:
+                self.scheduled = True
+                GLib.idle_add(self.schedule)
+
+    def schedule(self):
+        # runs on the main loop, where the frame clock may be used
+        if self.widget is not None and self.widget.get_realized():
+            self.widget.add_tick_callback(self.flush)
+        else:
+            GLib.timeout_add(int(self.FRAME * 1000), self.flush)
+        return False
+
+    def flush(self, *args):
+        with self.lock:
+            changed, self.changed = self.changed, set()
+            self.scheduled = False
+            values = dict(self.values)
+        for keys, callback in self.bindings:
+            if not changed.isdisjoint(keys):
+                self.notified += 1
+                callback(*(values.get(key) for key in keys))
+        return False # one-shot
+
+    def stats(self):
+        return {
+            'published': self.published,
+            'suppressed': self.suppressed,
+            'coalesced': self.coalesced,
+            'notified': self.notified,
+        }
@@ -0,0 +1,70 @@
+import json
+import socket
+import threading
+
+import pytest
+
+import client
+
+class FakeDaemon:
+    """the other end of a client request: reads the command and the payload, then replies."""
+
+    def __init__(self, reply=b'picked\n'):
+        self.sock, client_sock = socket.socketpair()
+        self.client_sock = client_sock
+        self.reply = reply
+        self.received = b''
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        with self.sock:
+            while True:
+                chunk = self.sock.recv(65536)
+                if not chunk:
+                    break
+                self.received += chunk
+            self.sock.sendall(self.reply)
+
+    def request(self):
+        """(command, payload) as received."""
+        self.thread.join()
+        header, _, payload = self.received.partition(b'\n')
+        return json.loads(header), payload
+
+def test_arguments_keep_their_spaces():
+    daemon = FakeDaemon()
+    assert client.request(daemon.client_sock, ['menu', '--match', 'a b']) == b'picked\n'
+    assert daemon.request() == (['menu', '--match', 'a b'], b'')
+
+def test_payload_is_streamed():
+    daemon = FakeDaemon()
+    r, w = socket.socketpair()
+    with w:
+        w.sendall(b'one\ntwo\n')
+    with r.makefile('rb') as payload:
+        assert client.request(daemon.client_sock, ['menu'], payload) == b'picked\n'
+    assert daemon.request() == (['menu'], b'one\ntwo\n')
+
+def test_bad_arguments_exit_in_the_client(monkeypatch, capsys):
+    monkeypatch.setattr(client, 'connect', lambda: pytest.fail("connected to the daemon"))
+    with pytest.raises(SystemExit) as exit:
+        client.main(['client.py', '--match', 'nonsense'])
+    assert exit.value.code == 2
+    assert "invalid choice" in capsys.readouterr().err
+
+def test_help_is_printed_by_the_client(monkeypatch, capsys):
+    monkeypatch.setattr(client, 'connect', lambda: pytest.fail("connected to the daemon"))
+    with pytest.raises(SystemExit) as exit:
+        client.main(['client.py', '--help'])
+    assert exit.value.code == 0
+    assert "--match" in capsys.readouterr().out
+
+def test_payload_from_a_regular_file(tmp_path):
+    # epoll can't watch regular files, e.g. client.py < items.txt
+    path = tmp_path / "items.txt"
+    path.write_bytes(b''.join(b'item %d\n' % i for i in range(100000)))
+    daemon = FakeDaemon()
+    with open(path, 'rb') as payload:
+        assert client.request(daemon.client_sock, ['menu'], payload) == b'picked\n'
+    assert daemon.request() == (['menu'], path.read_bytes())
@@ -0,0 +1,202 @@
+import os
+import json
+import socket
+import threading
+
+import pytest
+
+pytest.importorskip("gi")
+
+import hyprland
+
+class FakeHyprland:
+    """a stand-in for hyprland's request socket: one request per connection, answered from `replies`."""
+
+    def __init__(self, path, replies):
+        self.replies = replies
+        self.requests = []
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError: # closed
+                return
+            with conn:
+                request = conn.recv(65536).decode()
+                self.requests.append(request)
+                conn.sendall(self.replies(request).encode())
+
+    def close(self):
+        self.server.shutdown(socket.SHUT_RDWR) # wakes up accept
+        self.server.close()
+        self.thread.join()
+
+WORKSPACES = [
+    {"id": 2, "name": "2", "monitor": "DP-1", "windows": 1},
+    {"id": 1, "name": "1", "monitor": "eDP-1", "windows": 3},
+    {"id": -98, "name": "special:magic", "monitor": "DP-1", "windows": 1},
+]
+MONITORS = [
+    {"id": 0, "name": "eDP-1", "focused": False, "activeWorkspace": {"id": 1}},
+    {"id": 1, "name": "DP-1", "focused": True, "activeWorkspace": {"id": 2}},
+]
+
+def reply(request):
+    if request == "j/workspaces":
+        return json.dumps(WORKSPACES)
+    if request == "[[BATCH]]j/workspaces;j/monitors":
+        return json.dumps(WORKSPACES, indent=2) + "\n\n" + json.dumps(MONITORS, indent=2)
+    if request == "[[BATCH]]dispatch workspace 3;j/monitors":
+        return "ok" + json.dumps(MONITORS)
+    if request == "dispatch workspace 3":
+        return "ok"
+    return "unknown request"
+
+@pytest.fixture
+def client(tmp_path):
+    path = str(tmp_path / ".socket.sock")
+    server = FakeHyprland(path, reply)
+    yield hyprland.Client(path)
+    server.close()
+
+def test_request(client):
+    assert json.loads(client.request("j/workspaces")) == WORKSPACES
+
+def test_query(client):
+    assert client.query("workspaces") == WORKSPACES
+
+def test_batch_decodes_each_reply(client):
+    assert client.batch("j/workspaces", "j/monitors") == [WORKSPACES, MONITORS]
+
+def test_batch_mixes_plain_and_json_replies(client):
+    assert client.batch("dispatch workspace 3", "j/monitors") == ["ok", MONITORS]
+
+def test_batch_without_commands_sends_nothing(client):
+    assert client.batch() == []
+
+def test_dispatch(client):
+    client.dispatch("workspace", 3)
+    with pytest.raises(hyprland.HyprlandError):
+        client.dispatch("nonsense")
+
+def test_split_batch_reply():
+    reply = 'ok\n{"a": 1}[1, 2]\nunknown request: foo\n'
+    commands = ["dispatch workspace 1", "j/a", "j/b", "foo"]
+    assert hyprland.split_batch_reply(reply, commands) == ["ok", {"a": 1}, [1, 2], "unknown request: foo"]
+
+def test_sync(client):
+    model = hyprland.WorkspaceModel()
+    model.sync(client)
+    assert model.ids() == [1, 2]
+    assert model.monitors == {"eDP-1": 1, "DP-1": 2}
+    assert model.focused_monitor == "DP-1"
+    assert model.active == 2
+
+@pytest.fixture
+def model(client):
+    model = hyprland.WorkspaceModel()
+    model.sync(client)
+    return model
+
+def test_apply_create_and_destroy(model):
+    assert model.apply("createworkspacev2", "5,5")
+    assert model.ids() == [1, 2, 5]
+    assert model.workspaces[5].monitor == "DP-1" # created on the focused monitor
+    assert not model.apply("createworkspacev2", "5,5")
+    assert model.apply("destroyworkspacev2", "5,5")
+    assert model.ids() == [1, 2]
+
+def test_apply_skips_special_workspaces(model):
+    assert not model.apply("createworkspacev2", "-97,special:scratch")
+    assert not model.apply("createworkspace", "special:other")
+    assert model.ids() == [1, 2]
+
+def test_apply_v1_events_by_name(model):
+    assert model.apply("createworkspace", "7")
+    assert 7 in model.workspaces
+    assert model.apply("destroyworkspace", "7")
+    assert 7 not in model.workspaces
+
+def test_apply_workspace_switch(model):
+    assert model.apply("workspacev2", "1,1")
+    assert model.active == 1
+    assert not model.apply("workspace", "1")
+
+def test_apply_focused_monitor(model):
+    assert model.apply("focusedmonv2", "eDP-1,1")
+    assert model.focused_monitor == "eDP-1"
+    assert model.active == 1
+    assert model.apply("focusedmon", "DP-1,2")
+    assert model.active == 2
+
+def test_apply_move_workspace(model):
+    # moving doesn't change the ids or the active workspace
+    assert not model.apply("moveworkspacev2", "2,2,eDP-1")
+    assert model.workspaces[2].monitor == "eDP-1"
+    model.apply("moveworkspace", "2,DP-1")
+    assert model.workspaces[2].monitor == "DP-1"
+
+def test_apply_ignores_other_events(model):
+    assert not model.apply("activewindow", "foot,~")
+
+def instance(runtime, signature, sockets=(".socket.sock",)):
+    directory = runtime / "hypr" / signature
+    directory.mkdir(parents=True)
+    return [str(directory / name) for name in sockets]
+
+def test_socket_paths_prefer_own_instance_then_newest(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    monkeypatch.setenv("HYPRLAND_INSTANCE_SIGNATURE", "own")
+    paths = {}
+    for mtime, signature in enumerate(["own", "older", "newer"]):
+        path, = instance(tmp_path, signature)
+        open(path, 'w').close()
+        os.utime(path, (mtime, mtime))
+        paths[signature] = path
+    instance(tmp_path, "empty")
+    assert hyprland.socket_paths(".socket.sock") == [paths["own"], paths["newer"], paths["older"]]
+
+def test_client_follows_a_restarted_instance(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    monkeypatch.setenv("HYPRLAND_INSTANCE_SIGNATURE", "old")
+    old, = instance(tmp_path, "old")
+    server = FakeHyprland(old, reply)
+    client = hyprland.Client()
+    assert client.query("workspaces") == WORKSPACES
+    server.close() # hyprland crashed, leaving its socket behind
+    new, = instance(tmp_path, "new")
+    server = FakeHyprland(new, reply)
+    assert client.query("workspaces") == WORKSPACES
+    assert client.path == new
+    server.close()
+
+def coalesce(events):
+    coalescer = hyprland.EventCoalescer(None)
+    coalescer.scheduled = True # not flushed by the main loop
+    for event, data in events:
+        coalescer.push(event, data)
+    return [item for item in coalescer.pending if item is not None]
+
+def test_coalescer_keeps_the_latest_state():
+    assert coalesce([("workspacev2", "1,1"), ("activewindow", "a"), ("workspacev2", "2,2")]) == \
+        [("activewindow", "a"), ("workspacev2", "2,2")]
+
+def test_coalescer_keeps_focusedmon_per_monitor(model):
+    events = coalesce([("focusedmonv2", "eDP-1,3"), ("focusedmonv2", "DP-1,4"), ("focusedmonv2", "eDP-1,5")])
+    assert events == [("focusedmonv2", "DP-1,4"), ("focusedmonv2", "eDP-1,5")]
+    for event, data in events:
+        model.apply(event, data)
+    assert model.monitors == {"eDP-1": 5, "DP-1": 4}
+
+def test_coalescer_keeps_workspace_switches_on_each_monitor(model):
+    events = coalesce([("workspacev2", "3,3"), ("focusedmonv2", "eDP-1,1"), ("workspacev2", "6,6")])
+    assert len(events) == 3
+    for event, data in events:
+        model.apply(event, data)
+    assert model.monitors == {"eDP-1": 6, "DP-1": 3}
@@ -0,0 +1,96 @@
+import json
+import time
+import socket
+
+import pytest
+
+pytest.importorskip("gi")
+
+from gi.repository import GLib
+
+import mpv
+import scheduler
+
+def run_until(condition, timeout=5):
+    """iterate the main loop until condition() holds."""
+    context = GLib.MainContext.default()
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        context.iteration(False)
+        time.sleep(0.001)
+
+def read_commands(conn, count):
+    buffer = b''
+    while buffer.count(b'\n') < count:
+        buffer += conn.recv(65536)
+    return [json.loads(line) for line in buffer.splitlines()]
+
+def send_event(conn, id, name, data):
+    conn.sendall(json.dumps({'event': 'property-change', 'id': id, 'name': name, 'data': data}).encode() + b'\n')
+
+@pytest.fixture
+def server(tmp_path):
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(tmp_path / "mpvsocket"))
+    server.listen()
+    yield server
+    server.close()
+
+@pytest.fixture
+def published():
+    return []
+
+@pytest.fixture
+def source(tmp_path, published):
+    source = mpv.MpvSource(published.append, str(tmp_path / "mpvsocket"),
+                           fallback_command=['echo', 'from the fallback'], poll_interval=1)
+    yield source
+    if source.poll_source is not None:
+        scheduler.default().remove(source.poll_source)
+    if source.sock is not None:
+        source.sock.close()
+
+def test_observes_title_and_metadata(server, source):
+    source.start()
+    conn, _ = server.accept()
+    with conn:
+        commands = read_commands(conn, len(mpv.OBSERVED))
+    assert commands == [{'command': ['observe_property', id, name]} for id, name in mpv.OBSERVED.items()]
+    assert source.poll_source is None
+
+def test_property_changes_update_the_text(server, source, published):
+    source.start()
+    conn, _ = server.accept()
+    with conn:
+        send_event(conn, 1, 'media-title', 'song.flac')
+        run_until(lambda: published)
+        assert published == ['song.flac']
+        send_event(conn, 2, 'metadata', {'ARTIST': 'Artist', 'TITLE': 'Song'})
+        run_until(lambda: len(published) == 2)
+        assert published[-1] == 'Artist - Song'
+        # neither an unchanged text nor other properties are published
+        send_event(conn, 1, 'media-title', 'song.flac')
+        send_event(conn, 99, 'volume', 50)
+        send_event(conn, 2, 'metadata', {'ARTIST': 'Artist', 'TITLE': 'Other'})
+        run_until(lambda: len(published) == 3)
+        assert published == ['song.flac', 'Artist - Song', 'Artist - Other']
+
+def test_falls_back_to_polling_when_mpv_quits(server, source, published):
+    source.start()
+    conn, _ = server.accept()
+    send_event(conn, 1, 'media-title', 'song.flac')
+    run_until(lambda: published)
+    server.close() # mpv quit, the socket can't be reconnected
+    conn.close()
+    run_until(lambda: source.poll_source is not None)
+    assert source.sock is None
+    run_until(lambda: published[-1] == 'from the fallback')
+    assert published == ['song.flac', '', 'from the fallback']
+
+def test_polls_without_a_socket(source, published):
+    source.start()
+    assert source.sock is None
+    assert source.poll_source is not None
+    run_until(lambda: published)
+    assert published == ['from the fallback']
@@ -0,0 +1,39 @@
+import pytest
+
+import matcher
+import parallel
+
+ITEMS = [f"item {i} {'abc' if i % 3 == 0 else 'xyz'}" for i in range(1000)]
+
+@pytest.fixture
+def pool():
+    yield
+    for pool in parallel._pools.values():
+        pool.close()
+
+@pytest.fixture(autouse=True)
+def small_shards(monkeypatch):
+    monkeypatch.setattr(parallel, 'SHARD_SIZE', 100)
+
+def test_matches_like_the_serial_matcher(pool):
+    query = "i1ac"
+    assert parallel.ParallelMatcher(ITEMS, jobs=2).match(query) == matcher.Matcher(ITEMS).match(query)
+
+def test_newlines_in_the_query_match_spaces(pool):
+    # items can't hold newlines, see extend
+    items = ["b c", "bc", "b\nc"]
+    assert sorted(parallel.ParallelMatcher(items, jobs=2).match("b\nc", limit=10)) == [0, 2]
+
+def test_a_shard_that_kills_workers_is_searched_here(pool, monkeypatch):
+    send = parallel.ParallelMatcher.send
+
+    def send_crashing(self, worker, sequence, shard, query, limit):
+        # a query the worker can't compile, it dies with a traceback
+        send(self, worker, sequence, shard, None if shard[0] == 300 else query, limit)
+    monkeypatch.setattr(parallel.ParallelMatcher, 'send', send_crashing)
+    restarts = []
+    restart = parallel.Pool.restart
+    monkeypatch.setattr(parallel.Pool, 'restart', lambda pool, worker: restarts.append(1) or restart(pool, worker))
+    query = "abc"
+    assert parallel.ParallelMatcher(ITEMS, jobs=2).match(query) == matcher.Matcher(ITEMS).match(query)
+    assert len(restarts) == parallel.ATTEMPTS
@@ -0,0 +1,44 @@
+import time
+import threading
+
+import pytest
+
+pytest.importorskip("gi")
+
+import pulseaudio
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+def test_writer_survives_a_failing_write():
+    written = []
+    failed = threading.Event()
+
+    def write(volume):
+        if not failed.is_set():
+            failed.set()
+            raise OSError("pactl went away")
+        written.append(volume)
+
+    writer = pulseaudio.VolumeWriter(max_rate=1000, echo_window=0.05, write=write)
+    writer.set(10)
+    wait_for(failed.is_set)
+    wait_for(lambda: writer.echo_remaining() == 0)
+    writer.set(20)
+    wait_for(lambda: written)
+    assert written == [20]
+    assert writer.thread.is_alive()
+    wait_for(lambda: writer.echo_remaining() == 0)
+
+def test_writer_keeps_only_the_latest_value():
+    written = []
+    writer = pulseaudio.VolumeWriter(max_rate=1000, echo_window=0.05, write=written.append)
+    with writer.cond: # the thread can't take a value until we're done
+        writer.set(1)
+        writer.set(2)
+        writer.set(3)
+    wait_for(lambda: writer.echo_remaining() == 0)
+    assert written == [3]
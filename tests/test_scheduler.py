@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip("gi")
+
+import scheduler
+
+def test_failing_source_doesnt_stop_the_others():
+    sched = scheduler.Scheduler()
+    ran = []
+
+    def fail():
+        raise RuntimeError("broken source")
+
+    sched.add(fail, 1)
+    sched.add(lambda: ran.append(True), 1, cost=2) # runs after the cheaper failing one
+    for source in sched.sources:
+        source.due = 0 # due now
+    sched.on_wakeup()
+    assert ran == [True]
+    assert sched.timeout_source is not None # the next wakeup is scheduled
+    sched.remove(sched.sources[0])
+    sched.remove(sched.sources[0])
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+gi = pytest.importorskip("gi")
+try:
+    gi.require_version('GdkPixbuf', '2.0')
+except ValueError:
+    pytest.skip("GdkPixbuf isn't installed", allow_module_level=True)
+
+from gi.repository import GdkPixbuf
+
+import thumbnails
+
+def pixbuf():
+    pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False, 8, 100, 100)
+    pixbuf.fill(0x3366ccff)
+    return pixbuf
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for i in range(4):
+        path = tmp_path / f"image{i}.png"
+        path.write_bytes(b"not decoded here %d" % i)
+        paths.append(str(path))
+    return paths
+
+def make_cache(tmp_path, budget):
+    return thumbnails.ThumbnailCache(str(tmp_path / "thumbnails"), budget, str(tmp_path / "index.json"))
+
+def test_evicts_only_our_least_recently_used(tmp_path, images):
+    cache = make_cache(tmp_path, budget=1 << 30)
+    directory, _ = cache.bucket(100)
+    os.makedirs(directory)
+    foreign = os.path.join(directory, "0" * 32 + ".png") # a file manager's
+    pixbuf().savev(foreign, 'png', [], [])
+    cache.save(images[0], os.stat(images[0]), pixbuf())
+    size = cache.total
+    cache.budget = 2 * size
+    cache.save(images[1], os.stat(images[1]), pixbuf())
+    assert cache.load(images[0], os.stat(images[0]), 100) is not None # now the most recently used
+    cache.save(images[2], os.stat(images[2]), pixbuf())
+    assert cache.load(images[1], os.stat(images[1]), 100) is None
+    assert cache.load(images[0], os.stat(images[0]), 100) is not None
+    assert cache.load(images[2], os.stat(images[2]), 100) is not None
+    assert os.path.exists(foreign)
+
+def test_index_survives_a_restart(tmp_path, images):
+    cache = make_cache(tmp_path, budget=1 << 30)
+    for path in images:
+        cache.save(path, os.stat(path), pixbuf())
+    cache.close()
+    reopened = make_cache(tmp_path, budget=0)
+    reopened.save(images[0], os.stat(images[0]), pixbuf()) # over budget, everything goes
+    assert all(reopened.load(path, os.stat(path), 100) is None for path in images)
+    assert os.listdir(reopened.bucket(100)[0]) == []
@@ -0,0 +1,52 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip("gi")
+
+from gi.repository import GLib
+
+import utils
+
+def run_until(condition, timeout=5):
+    """iterate the main loop until condition() holds."""
+    context = GLib.MainContext.default()
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        context.iteration(False)
+        time.sleep(0.001)
+
+def running_in_group(pgid):
+    """pids of the live (not zombie) processes in a process group."""
+    pids = []
+    for entry in os.listdir('/proc'):
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if fields[0] != 'Z' and int(fields[2]) == pgid:
+            pids.append(int(entry))
+    return pids
+
+def test_lines_are_handled_including_the_last_one():
+    lines = []
+    subscription = utils.Subscription(['sh', '-c', 'printf "one\\ntwo\\nthree"'], lines.append)
+    subscription.start()
+    run_until(lambda: len(lines) == 3)
+    subscription.stop()
+    assert lines == ['one', 'two', 'three']
+
+def test_stop_ends_the_whole_pipeline():
+    lines = []
+    subscription = utils.Subscription(['sh', '-c', 'echo started; sleep 60 | cat'], lines.append)
+    subscription.start()
+    run_until(lambda: lines)
+    pgid = subscription.pid
+    assert len(running_in_group(pgid)) >= 2
+    subscription.stop()
+    assert subscription.streams == {}
+    run_until(lambda: not running_in_group(pgid))
+    run_until(lambda: subscription.pid is None) # reaped, and not restarted
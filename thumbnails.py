@@ -0,0 +1,352 @@
+import os
+import json
+import heapq
+import atexit
+import hashlib
+import tempfile
+import itertools
+import threading
+from collections import OrderedDict
+
+import gi
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import GLib, GdkPixbuf
+
+# requests visible on screen are decoded before the rest
+VISIBLE = 0
+BACKGROUND = 1
+
+CHUNK_SIZE = 64 * 1024 # bytes fed to the loader between checks for cancellation
+BATCH_INTERVAL = 50 # ms between handing finished thumbnails to the main loop
+
+# the freedesktop thumbnail sizes, https://specifications.freedesktop.org/thumbnail-spec/
+CACHE_SIZES = (('normal', 128), ('large', 256), ('x-large', 512), ('xx-large', 1024))
+CACHE_BUDGET = 256 * 1024 * 1024 # bytes of the thumbnails we wrote kept, least recently used go first
+INDEX_VERSION = 1
+SAVE_INDEX_EVERY = 64 # thumbnails written between saves of the index (it's saved at exit too)
+
+def fit(width, height, size):
+    """scale width x height down to fit in a size x size square, keeping the aspect ratio."""
+    if width <= size and height <= size:
+        return width, height
+    scale = size / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+class Cancelled(Exception):
+    pass
+
+def decode(path, size, cancelled=lambda: False):
+    """decode path to a pixbuf at most size x size.
+
+    the loader is told the target size before decoding starts, so e.g. jpegs
+    are decoded at reduced resolution instead of decoded in full and scaled."""
+    loader = GdkPixbuf.PixbufLoader()
+    loader.connect('size-prepared', lambda loader, width, height: loader.set_size(*fit(width, height, size)))
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                if cancelled():
+                    raise Cancelled
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                loader.write(chunk)
+    finally:
+        try:
+            loader.close()
+        except GLib.Error: # incomplete when cancelled, the error is already being raised otherwise
+            pass
+    pixbuf = loader.get_pixbuf()
+    if pixbuf is None:
+        raise GLib.Error(f"no image in {path}")
+    return pixbuf.apply_embedded_orientation()
+
+def cache_dir():
+    cache = os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache, "thumbnails")
+
+def default_index_path():
+    cache = os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache, "widgets", "thumbnails.json")
+
+class ThumbnailCache:
+    """thumbnails stored the freedesktop way, so they are shared with file managers.
+
+    a thumbnail is a png named after the md5 of the file's uri, in the
+    directory for the smallest standard size that fits the requested one,
+    and is valid while the file's mtime and size match those recorded in it.
+    writes go through a temporary file and a rename, so concurrent writers
+    (other threads, other programs) can't leave a partial one behind.
+
+    the thumbnails we wrote are kept in an index (at `index_path`), least
+    recently used first, and once they add up to more than `budget` bytes
+    the oldest are removed. the others belong to other programs and are
+    never touched, and access times aren't used since they are mostly not
+    updated (noatime, relatime)."""
+
+    def __init__(self, path=None, budget=CACHE_BUDGET, index_path=None):
+        self.path = path or cache_dir()
+        self.budget = budget
+        self.index_path = index_path or default_index_path()
+        self.lock = threading.Lock()
+        self.index = None # thumbnail path -> bytes, least recently used first, read on first use
+        self.total = 0
+        self.writes = 0
+
+    def bucket(self, size):
+        """(directory, size) the thumbnails for a size are kept in, None if it's too large."""
+        for name, bucket_size in CACHE_SIZES:
+            if size <= bucket_size:
+                return os.path.join(self.path, name), bucket_size
+        return None, None
+
+    def thumbnail_path(self, directory, uri):
+        return os.path.join(directory, hashlib.md5(uri.encode()).hexdigest() + ".png")
+
+    def load(self, path, stat, size):
+        """the cached thumbnail for path at the bucket size, or None."""
+        directory, _ = self.bucket(size)
+        if directory is None:
+            return None
+        uri = GLib.filename_to_uri(os.path.abspath(path))
+        thumbnail = self.thumbnail_path(directory, uri)
+        try:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file(thumbnail)
+        except GLib.Error:
+            return None
+        if pixbuf.get_option('tEXt::Thumb::MTime') != str(int(stat.st_mtime)):
+            return None
+        recorded_size = pixbuf.get_option('tEXt::Thumb::Size')
+        if recorded_size is not None and recorded_size != str(stat.st_size):
+            return None
+        with self.lock:
+            index = self.load_index()
+            if thumbnail in index:
+                index.move_to_end(thumbnail)
+        return pixbuf
+
+    def save(self, path, stat, pixbuf):
+        directory, _ = self.bucket(max(pixbuf.get_width(), pixbuf.get_height()))
+        if directory is None:
+            return
+        uri = GLib.filename_to_uri(os.path.abspath(path))
+        thumbnail = self.thumbnail_path(directory, uri)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".widgets-", suffix=".png", dir=directory)
+        os.close(fd)
+        try:
+            pixbuf.savev(tmp, 'png',
+                         ['tEXt::Thumb::URI', 'tEXt::Thumb::MTime', 'tEXt::Thumb::Size'],
+                         [uri, str(int(stat.st_mtime)), str(stat.st_size)])
+            size = os.stat(tmp).st_size
+            os.replace(tmp, thumbnail)
+        except (OSError, GLib.Error):
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+        with self.lock:
+            index = self.load_index()
+            self.total += size - index.pop(thumbnail, 0)
+            index[thumbnail] = size
+            self.evict()
+            self.writes += 1
+            if self.writes % SAVE_INDEX_EVERY == 0:
+                self.save_index()
+
+    def load_index(self):
+        # with the lock held
+        if self.index is None:
+            self.index = OrderedDict()
+            try:
+                with open(self.index_path) as f:
+                    index = json.load(f)
+                if index.get('version') == INDEX_VERSION:
+                    self.index.update(index['thumbnails'])
+            except (OSError, ValueError, TypeError, KeyError): # missing or damaged, start over
+                pass
+            self.total = sum(self.index.values())
+        return self.index
+
+    def save_index(self):
+        # with the lock held
+        if self.index is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            tmp = self.index_path + ".tmp"
+            with open(tmp, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'thumbnails': list(self.index.items())}, f)
+            os.replace(tmp, self.index_path)
+        except OSError: # e.g. a read-only home, they're just not evicted
+            pass
+
+    def evict(self):
+        # with the lock held. least recently used first, only ours
+        while self.total > self.budget and self.index:
+            thumbnail, size = self.index.popitem(last=False)
+            self.total -= size
+            try:
+                os.unlink(thumbnail)
+            except OSError: # already gone
+                pass
+
+    def close(self):
+        """save the index, for the order thumbnails were used in since the last save."""
+        with self.lock:
+            self.save_index()
+
+_default_cache = None
+
+def default_cache():
+    """return the shared thumbnail cache."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ThumbnailCache()
+        atexit.register(_default_cache.close)
+    return _default_cache
+
+class PixbufCache:
+    """decoded pixbufs by key, the least recently used dropped beyond max_bytes."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.pixbufs = OrderedDict()
+        self.bytes = 0
+
+    def get(self, key):
+        pixbuf = self.pixbufs.get(key)
+        if pixbuf is not None:
+            self.pixbufs.move_to_end(key)
+        return pixbuf
+
+    def put(self, key, pixbuf):
+        old = self.pixbufs.pop(key, None)
+        if old is not None:
+            self.bytes -= old.get_byte_length()
+        self.pixbufs[key] = pixbuf
+        self.bytes += pixbuf.get_byte_length()
+        while self.bytes > self.max_bytes and len(self.pixbufs) > 1:
+            _, evicted = self.pixbufs.popitem(last=False)
+            self.bytes -= evicted.get_byte_length()
+
+    def clear(self):
+        self.pixbufs.clear()
+        self.bytes = 0
+
+def scale(pixbuf, size):
+    width, height = fit(pixbuf.get_width(), pixbuf.get_height(), size)
+    if (width, height) == (pixbuf.get_width(), pixbuf.get_height()):
+        return pixbuf
+    return pixbuf.scale_simple(width, height, GdkPixbuf.InterpType.BILINEAR)
+
+class ThumbnailLoader:
+    """decodes thumbnails on a bounded pool of threads.
+
+    `request(key, path)` queues a file; `on_loaded([(key, pixbuf or None), ...])`
+    is called on the main loop with the thumbnails finished since the last
+    call (None if the file couldn't be decoded). requests can be moved ahead
+    with `prioritize` and dropped with `cancel`, including one that is being
+    decoded.
+
+    with a cache (see ThumbnailCache), thumbnails are looked up there first
+    and decoded ones are saved to it."""
+
+    def __init__(self, on_loaded, size=100, workers=None, cache=None):
+        self.on_loaded = on_loaded
+        self.size = size
+        self.cache = cache
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.cond = threading.Condition()
+        self.queue = [] # (priority, order, key), entries whose priority changed are skipped
+        self.requests = {} # key -> (priority, path) of everything queued
+        self.running = set() # keys being decoded
+        self.cancelled = set() # keys cancelled while being decoded
+        self.order = itertools.count()
+        self.finished = []
+        self.flush_source = None
+        self.threads = []
+
+    def request(self, key, path, priority=BACKGROUND):
+        with self.cond:
+            self.cancelled.discard(key)
+            self.requests[key] = (priority, path)
+            heapq.heappush(self.queue, (priority, next(self.order), key))
+            self.cond.notify()
+        if len(self.threads) < self.workers:
+            thread = threading.Thread(target=self.run, daemon=True, name="thumbnails")
+            self.threads.append(thread)
+            thread.start()
+
+    def prioritize(self, keys, priority=VISIBLE):
+        """move queued keys ahead of everything with a lower priority."""
+        with self.cond:
+            for key in keys:
+                request = self.requests.get(key)
+                if request is not None and request[0] > priority:
+                    self.requests[key] = (priority, request[1])
+                    heapq.heappush(self.queue, (priority, next(self.order), key))
+
+    def cancel(self, keys=None):
+        """drop the given requests, or all of them."""
+        with self.cond:
+            keys = list(self.requests) + list(self.running) if keys is None else keys
+            for key in keys:
+                self.requests.pop(key, None)
+                if key in self.running:
+                    self.cancelled.add(key)
+            if not self.requests:
+                self.queue = []
+            # finished but not handed to the main loop yet
+            keys = set(keys)
+            self.finished = [(key, pixbuf) for key, pixbuf in self.finished if key not in keys]
+
+    def next_request(self):
+        with self.cond:
+            while True:
+                while self.queue:
+                    priority, _, key = heapq.heappop(self.queue)
+                    request = self.requests.get(key)
+                    if request is not None and request[0] == priority: # not cancelled or moved
+                        del self.requests[key]
+                        self.running.add(key)
+                        return key, request[1]
+                self.cond.wait()
+
+    def run(self):
+        while True:
+            key, path = self.next_request()
+            try:
+                pixbuf = self.load(path, lambda: key in self.cancelled)
+            except (Cancelled, OSError, GLib.Error):
+                pixbuf = None
+            with self.cond:
+                self.running.discard(key)
+                if key in self.cancelled:
+                    self.cancelled.discard(key)
+                    continue
+                self.finished.append((key, pixbuf))
+                if self.flush_source is None:
+                    self.flush_source = GLib.timeout_add(BATCH_INTERVAL, self.flush)
+
+    def load(self, path, cancelled):
+        if self.cache is None:
+            return decode(path, self.size, cancelled)
+        stat = os.stat(path)
+        pixbuf = self.cache.load(path, stat, self.size)
+        if pixbuf is None:
+            # decoded at the cache's size, so it's of use at any size in the bucket
+            _, bucket_size = self.cache.bucket(self.size)
+            pixbuf = decode(path, bucket_size or self.size, cancelled)
+            if bucket_size is not None:
+                self.cache.save(path, stat, pixbuf)
+        return scale(pixbuf, self.size)
+
+    def flush(self):
+        with self.cond:
+            finished, self.finished = self.finished, []
+            self.flush_source = None
+        if finished:
+            self.on_loaded(finished)
+        return False
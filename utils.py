@@ -1,19 +1,169 @@
-import subprocess
-import threading
-
-def handle_command(command, handler):
-    # start the subprocess
-    process = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-
-    # process the output line by line
-    for line in process.stdout:
-        handler(line.strip())
+import os
+import sys
+import time
+import atexit
+import signal
+
+from gi.repository import GLib
+
+class Subscription:
+    """a long-running command whose output lines are handed to `handler` on the main loop.
+
+    stdout and stderr are watched with GLib io watches, so no thread is needed
+    per command. stderr is drained (and echoed to our stderr) so the child can't
+    stall on a full pipe. the child is reaped by a GLib child watch and restarted
+    with exponential backoff when it exits, until `stop` is called. it runs in
+    its own process group, so a pipeline (sh -c 'a | b') is stopped as a whole."""
+
+    def __init__(self, command, handler, min_backoff=1, max_backoff=60):
+        self.command = command
+        self.handler = handler
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+        self.pid = None
+        self.started_at = 0
+        self.stopped = False
+        self.streams = {} # fd -> io watch, until the child closes it
+        self.buffer = b''
+
+    def start(self):
+        try:
+            pid, _, stdout, stderr = GLib.spawn_async(
+                self.command,
+                flags=GLib.SpawnFlags.SEARCH_PATH | GLib.SpawnFlags.DO_NOT_REAP_CHILD,
+                child_setup=os.setpgrp,
+                standard_output=True,
+                standard_error=True,
+            )
+        except GLib.Error as e:
+            print(f"failed to start {self.command}: {e.message}", file=sys.stderr)
+            self.schedule_restart()
+            return
+        self.pid = pid
+        self.started_at = time.monotonic()
+        self.buffer = b''
+        for fd, callback in ((stdout, self.on_stdout), (stderr, self.on_stderr)):
+            self.streams[fd] = GLib.io_add_watch(fd, GLib.PRIORITY_DEFAULT,
+                                                 GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, callback)
+        # kept after stop, to reap the child
+        GLib.child_watch_add(GLib.PRIORITY_DEFAULT, pid, self.on_exit)
+
+    def on_stdout(self, fd, condition):
+        data = os.read(fd, 65536) if condition & GLib.IO_IN else b''
+        if not data:
+            if self.buffer: # last line without a newline
+                line, self.buffer = self.buffer, b''
+                self.handler(line.decode(errors='replace').strip())
+            return self.close_stream(fd)
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b'\n')
+        for line in lines:
+            self.handler(line.decode(errors='replace').strip())
+        return True
+
+    def on_stderr(self, fd, condition):
+        data = os.read(fd, 65536) if condition & GLib.IO_IN else b''
+        if not data:
+            return self.close_stream(fd)
+        sys.stderr.write(data.decode(errors='replace'))
+        return True
+
+    def close_stream(self, fd):
+        # from its io watch, which returns False and is removed with it
+        del self.streams[fd]
+        os.close(fd)
+        return False
+
+    def on_exit(self, pid, status):
+        GLib.spawn_close_pid(pid)
+        self.pid = None
+        if self.stopped:
+            return
+        # a command that ran for a while was probably fine, don't make it wait long
+        if time.monotonic() - self.started_at > self.max_backoff:
+            self.backoff = self.min_backoff
+        self.schedule_restart()
+
+    def schedule_restart(self):
+        if self.stopped:
+            return
+        GLib.timeout_add(int(self.backoff * 1000), self.restart)
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    def restart(self):
+        if not self.stopped:
+            self.start()
+        return False # one-shot
+
+    def stop(self):
+        self.stopped = True
+        for fd, source in self.streams.items():
+            GLib.source_remove(source)
+            os.close(fd)
+        self.streams = {}
+        if self.pid is not None:
+            try:
+                os.killpg(self.pid, signal.SIGTERM) # the child and everything it started
+            except ProcessLookupError:
+                pass
+
+subscriptions = []
 
 def handle_subprocess_subscription(command, handler):
-    output_thread = threading.Thread(target=handle_command, args=(command, handler))
-    output_thread.start()
\ No newline at end of file
+    """run command in the background and call handler(line) on the main loop for every output line."""
+    subscription = Subscription(command, handler)
+    subscriptions.append(subscription)
+    subscription.start()
+    return subscription
+
+def stop_subscriptions():
+    for subscription in subscriptions:
+        subscription.stop()
+    subscriptions.clear()
+
+atexit.register(stop_subscriptions)
+
+class LineReader:
+    """reads lines from a file descriptor on the main loop, in large chunks.
+
+    `on_lines(lines)` is called with every batch of complete (stripped) lines
+    as they arrive and `on_eof()` once the other end is closed."""
+
+    def __init__(self, fd, on_lines, on_eof=None, chunk_size=1 << 20):
+        self.fd = fd
+        self.on_lines = on_lines
+        self.on_eof = on_eof
+        self.chunk_size = chunk_size
+        self.buffer = b''
+        self.source = GLib.io_add_watch(fd, GLib.PRIORITY_DEFAULT,
+                                        GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self.on_readable)
+
+    def on_readable(self, fd, condition):
+        try:
+            data = os.read(fd, self.chunk_size) if condition & (GLib.IO_IN | GLib.IO_HUP) else b''
+        except BlockingIOError:
+            return True
+        except OSError:
+            data = b''
+        if not data:
+            self.source = None
+            if self.buffer: # last line without a newline
+                self.on_lines([self.buffer.decode(errors='replace').strip()])
+                self.buffer = b''
+            if self.on_eof:
+                self.on_eof()
+            return False
+        end = data.rfind(b'\n')
+        if end == -1:
+            self.buffer += data
+            return True
+        lines = (self.buffer + data[:end]).decode(errors='replace').split('\n')
+        self.buffer = data[end + 1:]
+        self.on_lines([line.strip() for line in lines])
+        return True
+
+    def stop(self):
+        if self.source is not None:
+            GLib.source_remove(self.source)
+            self.source = None